@@ -1,18 +1,29 @@
+import json
 import os
+import sqlite3
 import ssl
+import threading
 import time
-from datetime import datetime, timedelta
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from random import uniform
 
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from google.oauth2 import service_account
 import streamlit.components.v1 as components
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from requests.adapters import HTTPAdapter
+
+# Copy-on-write: DataFrames compartilhados entre sessões nunca são alterados no lugar
+pd.set_option("mode.copy_on_write", True)
 
 # Configurações iniciais
 st.set_page_config(
@@ -104,9 +115,1044 @@ COLUNAS_ESPERADAS = {
     "Calculos": ["Data", "Biologico", "Quimico", "Tempo", "Placa1", "Placa2", "Placa3", "MédiaPlacas", "Diluicao", "ConcObtida", "Dose", "ConcAtivo", "VolumeCalda", "ConcEsperada", "Razao", "Resultado", "Observacao"]
 }
 
+# Tipos das colunas, aplicados uma única vez na carga (ver _aplicar_esquema);
+# as demais colunas ficam como texto
+COLUNAS_CATEGORICAS = {"Nome", "Classe", "Fabricante", "Resultado", "Status"}
+COLUNAS_NUMERICAS = {
+    "Dose", "Concentracao", "DoseBiologico", "DoseQuimico", "VolumeCalda", "Tempo", "Placa1", "Placa2",
+    "Placa3", "MédiaPlacas", "Diluicao", "ConcObtida", "ConcAtivo", "ConcEsperada", "Razao"
+}
+COLUNAS_DATA = {"Data"}
+# Colunas numéricas que podem vir em notação científica como texto ("1,5e9", "2×10^8")
+COLUNAS_CIENTIFICAS = {"Concentracao", "Diluicao", "ConcObtida", "ConcAtivo", "ConcEsperada"}
+
+def _tipo_coluna(coluna):
+    if coluna in COLUNAS_CATEGORICAS:
+        return "category"
+    if coluna in COLUNAS_NUMERICAS:
+        return "float64"
+    if coluna in COLUNAS_DATA:
+        return "datetime64[ns]"
+    return "object"
+
+ESQUEMA = {nome: {coluna: _tipo_coluna(coluna) for coluna in colunas} for nome, colunas in COLUNAS_ESPERADAS.items()}
+
+def _aplicar_esquema(df, sheet_name, formatos=None):
+    """
+    Converte as colunas do DataFrame para os tipos definidos em ESQUEMA.
+    
+    Colunas que já estão no tipo certo não são tocadas, então reaplicar o
+    esquema depois de um concat ou de uma edição custa pouco. Valores vazios
+    viram NaN/NaT nas colunas numéricas e de data e "" nas de texto.
+    `formatos` é repassado a parse_date_series.
+    """
+    esquema = ESQUEMA.get(sheet_name)
+    if esquema is None:
+        return df
+    
+    convertidas = {}
+    for coluna, tipo in esquema.items():
+        if coluna not in df.columns:
+            continue
+        serie = df[coluna]
+        if tipo == "category":
+            if not isinstance(serie.dtype, pd.CategoricalDtype):
+                convertidas[coluna] = serie.fillna("").astype(str).astype("category")
+        elif tipo == "float64":
+            if serie.dtype != "float64":
+                if coluna in COLUNAS_CIENTIFICAS:
+                    convertidas[coluna] = parse_scientific_series(serie)[0]
+                else:
+                    convertidas[coluna] = pd.to_numeric(serie, errors="coerce").astype("float64")
+        elif tipo == "datetime64[ns]":
+            if not pd.api.types.is_datetime64_any_dtype(serie):
+                convertidas[coluna] = parse_date_series(serie, sheet_name, formatos)
+        elif serie.dtype == object and serie.hasnans:
+            convertidas[coluna] = serie.fillna("")
+    
+    if not convertidas:
+        return df
+    # Montar um novo DataFrame (em vez de atribuir coluna a coluna) mantém os
+    # blocos consolidados por tipo, o que deixa filtros e cópias mais baratos
+    tipado = pd.DataFrame({coluna: convertidas.get(coluna, df[coluna]) for coluna in df.columns}, index=df.index)
+    tipado.attrs = dict(df.attrs)
+    return tipado
+
+def _concentracao_como_texto(df):
+    """Concentração em notação científica (texto), como é digitada no editor de biológicos"""
+    df = df.copy(deep=False)
+    df["Concentracao"] = df["Concentracao"].map(lambda x: f"{float(x):.2e}" if pd.notna(x) else "")
+    return df
+
+def _para_edicao(df):
+    """
+    Cópia do DataFrame para o st.data_editor: colunas categóricas voltam a
+    ser texto, já que o editor não aceita valores fora das categorias
+    """
+    df = df.copy(deep=False)
+    for coluna in df.columns:
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype(object)
+    return df
+
+# Tempo de validade (em segundos) dos dados no cache compartilhado
+CACHE_TTL_SEGUNDOS = 300
+
+def _versao_conteudo(df):
+    """Versão de conteúdo do DataFrame: hash dos valores, do índice e das colunas"""
+    valores = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return hash((tuple(df.columns), valores.tobytes()))
+
+# Atributos de df.attrs que descrevem a carga de uma planilha (ver
+# SheetsLoader.alteradas); não valem para dados derivados ou editados
+ATRIBUTOS_CARGA = ("revisao", "impressao", "carregado_em")
+
+class SharedSheetCache:
+    """
+    Cache em memória compartilhado por todas as sessões do processo.
+    
+    Cada planilha tem sua própria entrada com timestamp, de modo que a
+    expiração e a invalidação são feitas por planilha. Os DataFrames
+    entregues às sessões são visões somente leitura (copy-on-write) do
+    mesmo objeto, sem cópias privadas por sessão.
+    
+    Toda gravação no cache calcula a versão do conteúdo da planilha, usada
+    como chave pelas estruturas derivadas dos dados (ver memo_por_versao);
+    recarregar dados iguais mantém a mesma versão. A versão fica associada
+    aos objetos entregues por get/peek (ver versao) e não a df.attrs, que o
+    pandas copia para recortes, cópias e a saída do data_editor.
+    """
+    
+    def __init__(self, ttl=CACHE_TTL_SEGUNDOS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._entregues = {}
+    
+    def _entregar(self, df, versao):
+        """Visão do DataFrame para uma sessão, registrada com a versão do conteúdo"""
+        visao = df.copy(deep=False)
+        chave = id(visao)
+        
+        # Sem o lock: o callback pode rodar na coleta de lixo de uma thread
+        # que já o detém. O id só é reaproveitado depois do callback
+        def esquecer(ref):
+            if self._entregues.get(chave, (None,))[0] is ref:
+                self._entregues.pop(chave, None)
+        
+        with self._lock:
+            self._entregues[chave] = (weakref.ref(visao, esquecer), versao)
+        return visao
+    
+    def versao(self, df):
+        """Versão do conteúdo de um DataFrame entregue pelo cache, ou None para qualquer outro (derivado, editado...)"""
+        with self._lock:
+            entregue = self._entregues.get(id(df))
+        if entregue is None or entregue[0]() is not df:
+            return None
+        return entregue[1]
+    
+    def get(self, sheet_name):
+        """Retorna o DataFrame da planilha ou None se ausente/expirado"""
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+        if entry is None:
+            return None
+        df, timestamp, versao = entry
+        if time.monotonic() - timestamp >= self.ttl:
+            return None
+        return self._entregar(df, versao)
+    
+    def peek(self, sheet_name):
+        """Retorna o último DataFrame conhecido da planilha, mesmo se expirado"""
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+        return self._entregar(entry[0], entry[2]) if entry is not None else None
+    
+    def set(self, sheet_name, df, expirado=False, **atributos):
+        """
+        Armazena o DataFrame da planilha e reinicia sua validade (ou já o marca como expirado)
+        
+        Os atributos de carga herdados do DataFrame de origem são descartados;
+        os informados (revisão e impressão da carga, ver SheetsLoader.alteradas)
+        são gravados em df.attrs.
+        """
+        timestamp = float("-inf") if expirado else time.monotonic()
+        df = df.copy(deep=False)
+        for atributo in ATRIBUTOS_CARGA:
+            df.attrs.pop(atributo, None)
+        df.attrs.update(atributos)
+        versao = _versao_conteudo(df)
+        with self._lock:
+            self._entries[sheet_name] = (df, timestamp, versao)
+    
+    def renovar(self, sheet_name, **atributos):
+        """Reinicia a validade da entrada sem trocar os dados (que se confirmou não terem mudado)"""
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+            if entry is not None:
+                df = entry[0].copy(deep=False)
+                df.attrs.update(atributos)
+                self._entries[sheet_name] = (df, time.monotonic(), entry[2])
+    
+    def append(self, sheet_name, novas_linhas):
+        """Acrescenta linhas à entrada da planilha, se existir, mantendo sua validade"""
+        if novas_linhas.empty:
+            return
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+            if entry is None:
+                return
+            df, timestamp, _ = entry
+            atualizado = _aplicar_esquema(pd.concat([df, novas_linhas], ignore_index=True), sheet_name)
+            atualizado.attrs = dict(df.attrs)
+            self._entries[sheet_name] = (atualizado, timestamp, _versao_conteudo(atualizado))
+    
+    def idade(self, sheet_name):
+        """Segundos desde a última gravação da planilha no cache (infinito se ausente ou expirada)"""
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+        return float("inf") if entry is None else time.monotonic() - entry[1]
+    
+    def expire(self, sheet_name):
+        """
+        Marca a entrada de uma planilha como expirada, mantendo os dados para exibição até a recarga
+        
+        A impressão da carga é descartada para que a recarga baixe a planilha
+        mesmo que ela não tenha mudado (os dados em cache podem ter linhas que
+        nunca chegaram a ela).
+        """
+        with self._lock:
+            entry = self._entries.get(sheet_name)
+            if entry is not None:
+                df = entry[0].copy(deep=False)
+                df.attrs.pop("impressao", None)
+                self._entries[sheet_name] = (df, float("-inf"), entry[2])
+    
+    def invalidate(self, sheet_name=None):
+        """Remove a entrada de uma planilha (ou de todas, se sheet_name for None)"""
+        with self._lock:
+            if sheet_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sheet_name, None)
+
+@st.cache_resource
+def get_shared_cache():
+    return SharedSheetCache()
+
+@st.cache_resource(max_entries=128, show_spinner=False)
+def _memo_versao(planilha, versao, nome, parametros, _calcular):
+    return _calcular()
+
+def versao_dados(df):
+    """Versão de conteúdo de um DataFrame entregue pelo cache compartilhado (None para dados derivados ou editados)"""
+    return get_shared_cache().versao(df)
+
+def memo_por_versao(versao, planilha, nome, parametros, calcular):
+    """
+    Memoiza um artefato derivado de uma planilha (lista de opções, recorte
+    filtrado, visão para edição...) pela versão de conteúdo dos dados de origem.
+    
+    A chave é (planilha, versão, nome, parâmetros); o resultado é
+    compartilhado entre sessões e não deve ser alterado por quem o recebe.
+    A versão vem de versao_dados; sem versão (dados fora do cache
+    compartilhado) o artefato é calculado na hora.
+    """
+    if versao is None:
+        return calcular()
+    return _memo_versao(planilha, versao, nome, parametros, calcular)
+
+def opcoes_coluna(df, planilha, coluna):
+    """Valores distintos e não vazios de uma coluna, em ordem alfabética (para filtros e seletores)"""
+    def calcular():
+        if coluna not in df.columns:
+            return []
+        return sorted({str(valor) for valor in df[coluna].dropna().unique()} - {""})
+    return memo_por_versao(versao_dados(df), planilha, "opcoes", (coluna,), calcular)
+
+def filtrar_tabela(df, planilha, filtros):
+    """
+    Recorte da planilha com as colunas esperadas e só as linhas que atendem
+    aos filtros ({coluna: valor}; "Todos" não filtra), mantendo o índice original
+    """
+    filtros = tuple(sorted((coluna, valor) for coluna, valor in dict(filtros).items() if valor != "Todos"))
+    
+    def calcular():
+        recorte = df
+        for coluna, valor in filtros:
+            recorte = recorte[recorte[coluna] == valor]
+        return recorte.reindex(columns=COLUNAS_ESPERADAS[planilha])
+    return memo_por_versao(versao_dados(df), planilha, "filtro", filtros, calcular)
+
+# Arquivo do espelho local das planilhas
+SQLITE_PATH = os.environ.get("EXPERIMENTOS_SQLITE_PATH", "dados_locais.sqlite3")
+
+class SQLiteMirror:
+    """
+    Espelho local (SQLite) das planilhas configuradas em COLUNAS_ESPERADAS.
+    
+    Guarda a última versão sincronizada de cada planilha, com o cabeçalho
+    real do servidor, e uma tabela de saída (_pendentes) com as inclusões
+    ainda não enviadas. Permite iniciar o app a partir do disco e não perder
+    gravações pendentes em um reinício. Erros do SQLite são registrados e
+    tratados como espelho indisponível, sem interromper o app.
+    """
+    
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS _sincronizacao ("
+                "planilha TEXT PRIMARY KEY, cabecalho TEXT, sincronizado_em TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS _pendentes ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, planilha TEXT, dados TEXT, criado_em TEXT)"
+            )
+            for sheet_name in COLUNAS_ESPERADAS:
+                self._create_table(sheet_name)
+    
+    @staticmethod
+    def _quote(nome):
+        return '"' + nome.replace('"', '""') + '"'
+    
+    def _create_table(self, sheet_name):
+        colunas = COLUNAS_ESPERADAS[sheet_name]
+        existentes = [linha[1] for linha in self._conn.execute(f"PRAGMA table_info({self._quote(sheet_name)})")]
+        if existentes and existentes != colunas:
+            # Esquema mudou no código: descartar o snapshot antigo
+            self._conn.execute(f"DROP TABLE {self._quote(sheet_name)}")
+            self._conn.execute("DELETE FROM _sincronizacao WHERE planilha = ?", (sheet_name,))
+        # Colunas sem tipo declarado preservam o tipo de cada valor (texto ou número)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._quote(sheet_name)} "
+            f"({', '.join(self._quote(c) for c in colunas)})"
+        )
+    
+    def load(self, sheet_name):
+        """Retorna o snapshot da planilha (normalizado como na leitura remota) ou None"""
+        try:
+            with self._lock:
+                meta = self._conn.execute(
+                    "SELECT cabecalho FROM _sincronizacao WHERE planilha = ?", (sheet_name,)
+                ).fetchone()
+                if meta is None:
+                    return None
+                colunas = COLUNAS_ESPERADAS[sheet_name]
+                linhas = self._conn.execute(
+                    f"SELECT * FROM {self._quote(sheet_name)} ORDER BY rowid"
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler o espelho local de {sheet_name}: {str(e)}")
+            return None
+        
+        registros = [dict(zip(colunas, linha)) for linha in linhas]
+        if registros:
+            df = _load_and_validate_sheet(sheet_name, _records_to_dataframe(registros, sheet_name))
+        else:
+            df = _aplicar_esquema(pd.DataFrame(columns=colunas), sheet_name)
+        df.attrs["cabecalho"] = json.loads(meta[0])
+        return df
+    
+    def replace(self, sheet_name, df):
+        """Substitui o snapshot da planilha pelo DataFrame sincronizado com o servidor"""
+        if sheet_name not in COLUNAS_ESPERADAS:
+            return
+        linhas = _frame_to_rows(df, sheet_name)
+        colunas = COLUNAS_ESPERADAS[sheet_name]
+        cabecalho = df.attrs.get("cabecalho", colunas)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(f"DELETE FROM {self._quote(sheet_name)}")
+                self._conn.executemany(
+                    f"INSERT INTO {self._quote(sheet_name)} VALUES ({', '.join('?' * len(colunas))})",
+                    linhas
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO _sincronizacao VALUES (?, ?, ?)",
+                    (sheet_name, json.dumps(cabecalho), datetime.now().isoformat(timespec="seconds"))
+                )
+        except sqlite3.Error as e:
+            print(f"Erro ao gravar o espelho local de {sheet_name}: {str(e)}")
+    
+    def outbox_add(self, sheet_name, data_dict):
+        """Registra uma inclusão pendente e retorna seu id (ou None se falhar)"""
+        try:
+            with self._lock, self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO _pendentes (planilha, dados, criado_em) VALUES (?, ?, ?)",
+                    (sheet_name, json.dumps(data_dict, default=str), datetime.now().isoformat(timespec="seconds"))
+                )
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Erro ao registrar pendência no espelho local: {str(e)}")
+            return None
+    
+    def outbox_remove(self, ids):
+        """Remove do espelho as inclusões já enviadas (ou descartadas)"""
+        ids = [id_ for id_ in ids if id_ is not None]
+        if not ids:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM _pendentes WHERE id = ?", [(id_,) for id_ in ids])
+        except sqlite3.Error as e:
+            print(f"Erro ao remover pendências do espelho local: {str(e)}")
+    
+    def outbox(self):
+        """Lista as inclusões pendentes como (id, planilha, dados)"""
+        try:
+            with self._lock:
+                linhas = self._conn.execute("SELECT id, planilha, dados FROM _pendentes ORDER BY id").fetchall()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler pendências do espelho local: {str(e)}")
+            return []
+        return [(id_, planilha, json.loads(dados)) for id_, planilha, dados in linhas]
+    
+    def status(self):
+        """Última sincronização de cada planilha e número de pendências"""
+        try:
+            with self._lock:
+                sincronizacoes = dict(self._conn.execute("SELECT planilha, sincronizado_em FROM _sincronizacao").fetchall())
+                pendentes = dict(self._conn.execute("SELECT planilha, COUNT(*) FROM _pendentes GROUP BY planilha").fetchall())
+        except sqlite3.Error as e:
+            print(f"Erro ao ler o estado do espelho local: {str(e)}")
+            return pd.DataFrame()
+        return pd.DataFrame([
+            {"Planilha": nome, "Sincronizado em": sincronizacoes.get(nome, "-"), "Pendências": pendentes.get(nome, 0)}
+            for nome in COLUNAS_ESPERADAS
+        ])
+
+@st.cache_resource
+def get_local_mirror():
+    try:
+        return SQLiteMirror()
+    except sqlite3.Error as e:
+        print(f"Espelho local indisponível ({SQLITE_PATH}): {str(e)}")
+        return None
+
+# Backend de armazenamento: "gspread" (Google Sheets), "local" (arquivo SQLite) ou "memoria" (simulado)
+STORAGE_BACKEND = os.environ.get("EXPERIMENTOS_BACKEND", "gspread")
+LOCAL_BACKEND_PATH = os.environ.get("EXPERIMENTOS_LOCAL_PATH", "planilha_local.sqlite3")
+
+class SimulatedQuotaError(Exception):
+    """Erro de quota gerado pelo backend simulado (mesma mensagem do Google)"""
+
+class MemorySpreadsheetClient:
+    """
+    Backend em memória com a mesma interface do cliente gspread usada pelo app.
+    
+    Implementa o subconjunto usado pela camada de dados: open_by_key,
+    Spreadsheet.worksheets/fetch_sheet_metadata/values_batch_get/worksheet/
+    get_lastUpdateTime e Worksheet.get_all_records/append_row(s)/update/
+    batch_update/batch_clear/clear. Toda escrita atualiza o modifiedTime do
+    arquivo, como faz o Drive.
+    Cada operação passa por request(), como no gspread, o que permite que o
+    limitador e a instrumentação funcionem igual para todos os backends.
+    
+    Args:
+        dados (dict): Nome da planilha -> DataFrame inicial (padrão: só cabeçalhos)
+        latencia (float): Atraso simulado por requisição, em segundos
+        taxa_erro_quota (float): Probabilidade (0 a 1) de uma requisição falhar por quota
+        quota_por_minuto (int): Requisições aceitas por minuto antes de falhar por quota
+        max_linhas (int): Número máximo de linhas por aba
+        latencia_conexao (float): Custo simulado de abrir uma conexão (TCP + TLS)
+        pool_conexoes (int): Conexões ociosas mantidas para reuso, como no
+            HTTPAdapter do requests (None: todas são reaproveitadas)
+    """
+    
+    def __init__(self, dados=None, latencia=0.0, taxa_erro_quota=0.0, quota_por_minuto=None, max_linhas=None,
+                 latencia_conexao=0.0, pool_conexoes=None):
+        self.latencia = latencia
+        self.taxa_erro_quota = taxa_erro_quota
+        self.quota_por_minuto = quota_por_minuto
+        self.max_linhas = max_linhas
+        self.latencia_conexao = latencia_conexao
+        self.pool_conexoes = pool_conexoes
+        self.conexoes_abertas = 0
+        self._conexoes_livres = 0
+        self.chamadas = {}
+        self._lock = threading.Lock()
+        self._janela = []
+        self._grids = {}
+        self._gids = {}
+        self.modificado = datetime.now(timezone.utc)
+        for nome, colunas in COLUNAS_ESPERADAS.items():
+            df = (dados or {}).get(nome)
+            linhas = _frame_to_rows(df, nome) if df is not None else []
+            self._grids[nome] = [list(colunas)] + linhas
+            self._gids[nome] = int(SHEET_GIDS.get(nome, len(self._gids) + 1))
+    
+    def request(self, method, endpoint, **kwargs):
+        """Simula uma requisição HTTP: conexão, latência, quota e contagem por operação"""
+        with self._lock:
+            reaproveitada = self._conexoes_livres > 0
+            if reaproveitada:
+                self._conexoes_livres -= 1
+            else:
+                self.conexoes_abertas += 1
+        try:
+            if not reaproveitada and self.latencia_conexao:
+                time.sleep(self.latencia_conexao)
+            return self._request(method, endpoint, **kwargs)
+        finally:
+            # Devolver a conexão ao pool, se ainda houver espaço para ela
+            with self._lock:
+                if self.pool_conexoes is None or self._conexoes_livres < self.pool_conexoes:
+                    self._conexoes_livres += 1
+    
+    def _request(self, method, endpoint, **kwargs):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self._lock:
+            agora = time.monotonic()
+            self.chamadas[endpoint] = self.chamadas.get(endpoint, 0) + 1
+            if self.quota_por_minuto is not None:
+                self._janela = [t for t in self._janela if agora - t < 60]
+                if len(self._janela) >= self.quota_por_minuto:
+                    raise SimulatedQuotaError("Quota exceeded for quota metric 'Requests' (simulado)")
+                self._janela.append(agora)
+        if self.taxa_erro_quota and uniform(0, 1) < self.taxa_erro_quota:
+            raise SimulatedQuotaError("Quota exceeded for quota metric 'Requests' (simulado)")
+    
+    def open_by_key(self, key):
+        self.request("get", "spreadsheets.get")
+        return MemorySpreadsheet(self, key)
+    
+    def _alterado(self, title):
+        """Registra uma escrita na aba: avança o modifiedTime do arquivo e persiste a aba"""
+        with self._lock:
+            # Estritamente crescente, mesmo com duas escritas no mesmo instante
+            self.modificado = max(datetime.now(timezone.utc), self.modificado + timedelta(microseconds=1))
+        self._persist(title)
+    
+    def _persist(self, title):
+        """Ponto de extensão para backends que gravam as abas em disco"""
+
+class MemorySpreadsheet:
+    def __init__(self, client, key):
+        self.client = client
+        self.id = key
+    
+    def fetch_sheet_metadata(self, params=None):
+        self.client.request("get", "spreadsheets.get")
+        return {"sheets": [
+            {"properties": {"sheetId": gid, "title": title}}
+            for title, gid in self.client._gids.items()
+        ]}
+    
+    def worksheets(self):
+        metadata = self.fetch_sheet_metadata()
+        return [MemoryWorksheet(self, aba["properties"]) for aba in metadata["sheets"]]
+    
+    def get_lastUpdateTime(self):
+        self.client.request("get", "drive.files.get")
+        with self.client._lock:
+            return self.client.modificado.isoformat(timespec="microseconds").replace("+00:00", "Z")
+    
+    def worksheet(self, title):
+        self.client.request("get", "spreadsheets.get")
+        if title not in self.client._grids:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return MemoryWorksheet(self, {"sheetId": self.client._gids[title], "title": title})
+    
+    def values_batch_get(self, ranges, params=None):
+        self.client.request("get", "values.batchGet")
+        with self.client._lock:
+            return {"valueRanges": [{"range": r, "values": self._range_values(r)} for r in ranges]}
+    
+    def _range_values(self, intervalo):
+        """Valores de um intervalo A1 ("'Aba'" ou "'Aba'!A:C", com '' escapando aspas no título)"""
+        if intervalo.endswith("'"):
+            titulo, faixa = intervalo, ""
+        else:
+            titulo, _, faixa = intervalo.rpartition("!")
+        if titulo.startswith("'"):
+            titulo = titulo[1:-1].replace("''", "'")
+        grid = self.client._grids.get(titulo, [])
+        if faixa:
+            grade = gspread.utils.a1_range_to_grid_range(faixa)
+            colunas = slice(grade.get("startColumnIndex", 0), grade.get("endColumnIndex"))
+            grid = [linha[colunas] for linha in grid[grade.get("startRowIndex", 0):grade.get("endRowIndex")]]
+        return _grid_values(grid)
+
+def _grid_values(grid):
+    """Valores formatados como a API devolve: texto, sem células/linhas vazias no final"""
+    valores = []
+    for linha in grid:
+        linha = ["" if v is None else str(v) for v in linha]
+        while linha and linha[-1] == "":
+            linha.pop()
+        valores.append(linha)
+    while valores and not valores[-1]:
+        valores.pop()
+    return valores
+
+class MemoryWorksheet:
+    def __init__(self, spreadsheet, properties):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.id = properties["sheetId"]
+        self.title = properties["title"]
+    
+    @property
+    def _grid(self):
+        return self.client._grids[self.title]
+    
+    @property
+    def row_count(self):
+        return max(len(self._grid), 1000)
+    
+    @property
+    def col_count(self):
+        return max(len(self._grid[0]) if self._grid else 0, 26)
+    
+    def _check_rows(self, total):
+        if self.client.max_linhas is not None and total > self.client.max_linhas:
+            raise ValueError(f"Limite de {self.client.max_linhas} linhas excedido na aba {self.title}")
+    
+    def _write(self, intervalo, valores):
+        grade = gspread.utils.a1_range_to_grid_range(intervalo)
+        inicio_linha = grade.get("startRowIndex", 0)
+        inicio_coluna = grade.get("startColumnIndex", 0)
+        self._check_rows(inicio_linha + len(valores))
+        grid = self._grid
+        for i, linha in enumerate(valores):
+            while len(grid) <= inicio_linha + i:
+                grid.append([])
+            destino = grid[inicio_linha + i]
+            for j, valor in enumerate(linha):
+                while len(destino) <= inicio_coluna + j:
+                    destino.append("")
+                destino[inicio_coluna + j] = valor
+    
+    def get_all_records(self):
+        self.client.request("get", "values.get")
+        with self.client._lock:
+            return _values_to_records(_grid_values(self._grid))
+    
+    def append_rows(self, values, value_input_option="RAW", **kwargs):
+        self.client.request("post", "values.append")
+        with self.client._lock:
+            self._check_rows(len(self._grid) + len(values))
+            self._grid.extend([list(linha) for linha in values])
+        self.client._alterado(self.title)
+    
+    def append_row(self, values, value_input_option="RAW", **kwargs):
+        self.append_rows([values], value_input_option=value_input_option)
+    
+    def update(self, range_name, values=None, **kwargs):
+        if values is None:
+            range_name, values = "A1", range_name
+        self.client.request("put", "values.update")
+        with self.client._lock:
+            self._write(range_name, values)
+        self.client._alterado(self.title)
+    
+    def batch_update(self, data, **kwargs):
+        self.client.request("post", "values.batchUpdate")
+        with self.client._lock:
+            for intervalo in data:
+                self._write(intervalo["range"], intervalo["values"])
+        self.client._alterado(self.title)
+    
+    def batch_clear(self, ranges):
+        self.client.request("post", "values.batchClear")
+        with self.client._lock:
+            for intervalo in ranges:
+                grade = gspread.utils.a1_range_to_grid_range(intervalo)
+                fim_linha = min(grade.get("endRowIndex", len(self._grid)), len(self._grid))
+                for i in range(grade.get("startRowIndex", 0), fim_linha):
+                    linha = self._grid[i]
+                    fim_coluna = min(grade.get("endColumnIndex", len(linha)), len(linha))
+                    for j in range(grade.get("startColumnIndex", 0), fim_coluna):
+                        linha[j] = ""
+            _trim_grid(self._grid)
+        self.client._alterado(self.title)
+    
+    def clear(self):
+        self.client.request("post", "values.clear")
+        with self.client._lock:
+            del self._grid[:]
+        self.client._alterado(self.title)
+
+def _trim_grid(grid):
+    """Remove as linhas vazias do final da aba (como ocorre na leitura pela API)"""
+    while grid and all(v in ("", None) for v in grid[-1]):
+        grid.pop()
+
+class LocalSpreadsheetClient(MemorySpreadsheetClient):
+    """
+    Backend local: as abas ficam em um arquivo SQLite (uma linha JSON por aba)
+    e são regravadas a cada escrita. Útil para rodar o app sem credenciais.
+    """
+    
+    def __init__(self, path=LOCAL_BACKEND_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS abas (titulo TEXT PRIMARY KEY, valores TEXT)")
+        for titulo, valores in self._conn.execute("SELECT titulo, valores FROM abas"):
+            if titulo in self._grids:
+                self._grids[titulo] = json.loads(valores)
+        for titulo in self._grids:
+            self._persist(titulo)
+    
+    def _persist(self, title):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO abas VALUES (?, ?)",
+                (title, json.dumps(self._grids[title], default=str))
+            )
+
+def create_storage_client(backend=STORAGE_BACKEND, **opcoes):
+    """
+    Cria o cliente do backend de armazenamento de teste/local.
+    
+    Args:
+        backend (str): "memoria" ou "local"
+        **opcoes: Repassadas ao construtor (latencia, taxa_erro_quota, etc.)
+        
+    Returns:
+        MemorySpreadsheetClient: Cliente com a interface usada do gspread
+    """
+    # O pool simulado tem o mesmo tamanho do pool HTTP do cliente gspread
+    opcoes.setdefault("pool_conexoes", HTTP_POOL_TAMANHO)
+    if backend == "memoria":
+        opcoes.setdefault("latencia", float(os.environ.get("EXPERIMENTOS_FAKE_LATENCIA", 0)))
+        opcoes.setdefault("taxa_erro_quota", float(os.environ.get("EXPERIMENTOS_FAKE_ERRO_QUOTA", 0)))
+        if os.environ.get("EXPERIMENTOS_FAKE_MAX_LINHAS"):
+            opcoes.setdefault("max_linhas", int(os.environ["EXPERIMENTOS_FAKE_MAX_LINHAS"]))
+        return MemorySpreadsheetClient(**opcoes)
+    if backend == "local":
+        return LocalSpreadsheetClient(**opcoes)
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
+
+# Quotas da API do Google Sheets (requisições por minuto) usadas pelo limitador local
+SHEETS_QUOTA_LEITURA_POR_MINUTO = 60
+SHEETS_QUOTA_ESCRITA_POR_MINUTO = 60
+# Espera máxima na fila do limitador antes de desistir da chamada (segundos)
+SHEETS_ESPERA_MAXIMA = 20
+
+class RateLimitExceeded(Exception):
+    """Chamada recusada pelo limitador local por exceder a espera máxima"""
+
+class TokenBucket:
+    """
+    Token bucket thread-safe com reserva de tokens.
+    
+    Cada chamada reserva um token; se não houver saldo, calcula quanto tempo
+    falta para a reposição e aguarda na fila (em ordem de chegada). Se a
+    espera ultrapassar o limite, a chamada é recusada antes de chegar ao Google.
+    """
+    
+    def __init__(self, quota_por_minuto, capacidade=None):
+        self.rate = quota_por_minuto / 60.0
+        self.capacidade = capacidade if capacidade is not None else quota_por_minuto
+        self._tokens = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requisicoes": 0,
+            "esperas": 0,
+            "recusadas": 0,
+            "na_fila": 0,
+            "espera_total": 0.0,
+            "espera_maxima": 0.0
+        }
+    
+    def _repor(self):
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.rate)
+        self._ultimo = agora
+    
+    def acquire(self, espera_maxima=SHEETS_ESPERA_MAXIMA):
+        """Reserva um token, aguardando se necessário; retorna o tempo de espera"""
+        with self._lock:
+            self._repor()
+            espera = max(0.0, (1 - self._tokens) / self.rate)
+            if espera > espera_maxima:
+                self._stats["recusadas"] += 1
+                raise RateLimitExceeded(
+                    f"Quota exceeded (limite local): espera estimada de {espera:.1f}s"
+                )
+            self._tokens -= 1
+            self._stats["requisicoes"] += 1
+            if espera > 0:
+                self._stats["esperas"] += 1
+                self._stats["na_fila"] += 1
+                self._stats["espera_total"] += espera
+                self._stats["espera_maxima"] = max(self._stats["espera_maxima"], espera)
+        
+        if espera > 0:
+            time.sleep(espera)
+            with self._lock:
+                self._stats["na_fila"] -= 1
+        return espera
+    
+    def snapshot(self):
+        """Retorna uma cópia das estatísticas e do saldo atual de tokens"""
+        with self._lock:
+            self._repor()
+            stats = dict(self._stats)
+            stats["tokens_disponiveis"] = max(0.0, self._tokens)
+        stats["espera_media"] = stats["espera_total"] / stats["esperas"] if stats["esperas"] else 0.0
+        return stats
+
+class SheetsRateLimiter:
+    """
+    Limitador do processo com um bucket para leituras e outro para escritas.
+    
+    A espera máxima na fila é SHEETS_ESPERA_MAXIMA, ou a definida com
+    limitar_espera() para as requisições da thread atual.
+    """
+    
+    def __init__(self, quota_leitura=SHEETS_QUOTA_LEITURA_POR_MINUTO, quota_escrita=SHEETS_QUOTA_ESCRITA_POR_MINUTO):
+        self.buckets = {
+            "leitura": TokenBucket(quota_leitura),
+            "escrita": TokenBucket(quota_escrita)
+        }
+        self._local = threading.local()
+    
+    @contextmanager
+    def limitar_espera(self, segundos):
+        """Limita a espera na fila das requisições feitas por esta thread dentro do bloco"""
+        anterior = getattr(self._local, "espera_maxima", SHEETS_ESPERA_MAXIMA)
+        self._local.espera_maxima = min(anterior, segundos)
+        try:
+            yield
+        finally:
+            self._local.espera_maxima = anterior
+    
+    def acquire(self, tipo):
+        return self.buckets[tipo].acquire(getattr(self._local, "espera_maxima", SHEETS_ESPERA_MAXIMA))
+    
+    def snapshot(self):
+        return {tipo: bucket.snapshot() for tipo, bucket in self.buckets.items()}
+
+@st.cache_resource
+def get_rate_limiter():
+    return SheetsRateLimiter()
+
+# Quantidade de latências recentes guardadas por operação para os percentis
+METRICAS_AMOSTRAS = 1000
+
+class SheetsMetrics:
+    """
+    Métricas do processo para as chamadas ao Google Sheets.
+    
+    Cada requisição HTTP é contada e cronometrada em um único ponto, o
+    Client.request instrumentado por _limit_client_requests, por operação,
+    planilha e resultado (sucesso, quota ou erro), com as latências recentes
+    guardadas para os percentis. A operação e a planilha vêm do rótulo
+    aberto com rotular() pela thread que fez a requisição. Também registra
+    as retentativas, as leituras coalescidas (que aproveitaram uma leitura
+    igual já em andamento, ver SingleFlight), os handles servidos pelo
+    registro sem requisição, os acertos do cache compartilhado e a duração
+    de cada rerun do script.
+    """
+    
+    def __init__(self, amostras=METRICAS_AMOSTRAS):
+        self._amostras = amostras
+        self._lock = threading.Lock()
+        self._chamadas = {}
+        self._handles = {"acerto": 0, "resolvido": 0}
+        self._cache = {}
+        self._reruns = {}
+        self._rotulos = threading.local()
+        self.inicio = datetime.now()
+    
+    @staticmethod
+    def classificar(erro=None):
+        """Resultado de uma chamada a partir da exceção (ou None se deu certo)"""
+        if erro is None:
+            return "sucesso"
+        return "quota" if "Quota exceeded" in str(erro) else "erro"
+    
+    def _entrada(self, operacao, planilha):
+        chave = (operacao, planilha)
+        if chave not in self._chamadas:
+            self._chamadas[chave] = {
+                "sucesso": 0,
+                "quota": 0,
+                "erro": 0,
+                "retentativas": 0,
+                "coalescidas": 0,
+                "latencias": deque(maxlen=self._amostras)
+            }
+        return self._chamadas[chave]
+    
+    def registrar(self, operacao, planilha, duracao, erro=None):
+        with self._lock:
+            entrada = self._entrada(operacao, planilha)
+            entrada[self.classificar(erro)] += 1
+            entrada["latencias"].append(duracao)
+    
+    @contextmanager
+    def rotular(self, operacao, planilha="-"):
+        """Atribui à operação e à planilha as requisições feitas por esta thread dentro do bloco"""
+        pilha = self._rotulos.__dict__.setdefault("pilha", [])
+        pilha.append((operacao, planilha))
+        try:
+            yield
+        finally:
+            pilha.pop()
+    
+    def registrar_requisicao(self, method, endpoint, duracao, erro=None):
+        """Registra uma requisição HTTP com o rótulo atual da thread (ou o método e o endpoint, sem rótulo)"""
+        pilha = self._rotulos.__dict__.get("pilha")
+        if pilha:
+            operacao, planilha = pilha[-1]
+        else:
+            operacao, planilha = f"{method.upper()} {str(endpoint).split('?')[0].replace(SHEET_ID, '{id}')}", "-"
+        self.registrar(operacao, planilha, duracao, erro)
+    
+    def registrar_handle(self, resultado):
+        """resultado: "acerto" (handle reaproveitado, sem requisição) ou "resolvido" (buscado na API)"""
+        with self._lock:
+            self._handles[resultado] += 1
+    
+    def registrar_retentativa(self, operacao, planilha="-"):
+        with self._lock:
+            self._entrada(operacao, planilha)["retentativas"] += 1
+    
+    def registrar_coalescida(self, operacao, planilha="-"):
+        with self._lock:
+            self._entrada(operacao, planilha)["coalescidas"] += 1
+    
+    def total(self, resultado):
+        """Total de chamadas com o resultado ("sucesso", "quota" ou "erro") desde o início"""
+        with self._lock:
+            return sum(e[resultado] for e in self._chamadas.values())
+    
+    def registrar_cache(self, planilha, resultado):
+        """resultado: "acerto" (válido), "expirado" (servido e recarregado) ou "falta" """
+        with self._lock:
+            contagem = self._cache.setdefault(planilha, {"acerto": 0, "expirado": 0, "falta": 0})
+            contagem[resultado] += 1
+    
+    def registrar_rerun(self, pagina, duracao):
+        with self._lock:
+            self._reruns.setdefault(pagina, deque(maxlen=self._amostras)).append(duracao)
+    
+    @staticmethod
+    def _percentis(valores):
+        if not valores:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "maximo": 0.0}
+        p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+        return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "maximo": float(max(valores))}
+    
+    def snapshot(self):
+        """Retorna uma cópia serializável das métricas, com os percentis já calculados"""
+        with self._lock:
+            chamadas = {chave: dict(e, latencias=list(e["latencias"])) for chave, e in self._chamadas.items()}
+            handles = dict(self._handles)
+            cache = {planilha: dict(c) for planilha, c in self._cache.items()}
+            reruns = {pagina: list(d) for pagina, d in self._reruns.items()}
+        
+        return {
+            "inicio": self.inicio.isoformat(timespec="seconds"),
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "chamadas": [
+                {
+                    "operacao": operacao,
+                    "planilha": planilha,
+                    "total": e["sucesso"] + e["quota"] + e["erro"],
+                    "sucesso": e["sucesso"],
+                    "quota": e["quota"],
+                    "erro": e["erro"],
+                    "retentativas": e["retentativas"],
+                    "coalescidas": e["coalescidas"],
+                    **self._percentis(e["latencias"])
+                }
+                for (operacao, planilha), e in sorted(chamadas.items())
+            ],
+            "handles": handles,
+            "cache": [
+                {
+                    "planilha": planilha,
+                    **c,
+                    "taxa_acerto": c["acerto"] / sum(c.values()) if sum(c.values()) else 0.0
+                }
+                for planilha, c in sorted(cache.items())
+            ],
+            "reruns": [
+                {"pagina": pagina, "total": len(duracoes), **self._percentis(duracoes)}
+                for pagina, duracoes in sorted(reruns.items())
+            ]
+        }
+
+@st.cache_resource
+def get_metrics():
+    return SheetsMetrics()
+
+def _limit_client_requests(client, limiter, metrics):
+    """
+    Faz todas as requisições do cliente gspread passarem pelo limitador e
+    pelas métricas.
+    
+    Client.request é o ponto único usado por Spreadsheet e Worksheet; GETs
+    contam como leitura e os demais métodos como escrita. As chamadas à API
+    do Drive (revisão do arquivo) têm quota própria e não passam pelo
+    limitador. Cada requisição é contada e cronometrada aqui (sem a espera
+    no limitador), com o rótulo da operação em andamento (ver
+    SheetsMetrics.rotular).
+    """
+    request_original = client.request
+    
+    def request(method, endpoint, *args, **kwargs):
+        if "drive" not in str(endpoint):
+            limiter.acquire("leitura" if method.lower() == "get" else "escrita")
+        inicio = time.perf_counter()
+        try:
+            resposta = request_original(method, endpoint, *args, **kwargs)
+        except Exception as e:
+            metrics.registrar_requisicao(method, endpoint, time.perf_counter() - inicio, e)
+            raise
+        metrics.registrar_requisicao(method, endpoint, time.perf_counter() - inicio)
+        return resposta
+    
+    client.request = request
+    return client
+
+# Threads do executor de I/O compartilhado (ver get_io_executor)
+SHEETS_IO_WORKERS = 4
+# Conexões HTTP mantidas abertas: executor de I/O, cargas paralelas por planilha e fila de gravação
+HTTP_POOL_TAMANHO = SHEETS_IO_WORKERS + len(SHEET_GIDS) + 1
+# Timeouts das requisições ao Google (segundos): abertura da conexão e leitura da resposta
+SHEETS_TIMEOUT_CONEXAO = 5
+SHEETS_TIMEOUT_LEITURA = 60
+
+def _configurar_sessao_http(client):
+    """
+    Ajusta a sessão HTTP do cliente gspread para uso concorrente.
+    
+    O pool comporta todas as threads que acessam a API ao mesmo tempo, de modo
+    que as conexões (e o handshake TLS) são reaproveitadas entre chamadas e
+    sessões. As respostas vêm comprimidas (o Google só usa gzip quando o
+    User-Agent também contém "gzip") e toda requisição tem timeout.
+    """
+    adapter = HTTPAdapter(pool_connections=3, pool_maxsize=HTTP_POOL_TAMANHO, max_retries=0)
+    client.session.mount("https://", adapter)
+    client.session.headers.update({
+        "Accept-Encoding": "gzip",
+        "Connection": "keep-alive",
+        "User-Agent": f"experimentos (gzip) {client.session.headers.get('User-Agent', '')}".strip()
+    })
+    client.set_timeout((SHEETS_TIMEOUT_CONEXAO, SHEETS_TIMEOUT_LEITURA))
+    return client
+
 @st.cache_resource
 def get_google_sheets_client():
     try:
+        # Backends alternativos (local ou simulado) não usam credenciais
+        if STORAGE_BACKEND != "gspread":
+            return _limit_client_requests(create_storage_client(STORAGE_BACKEND), get_rate_limiter(), get_metrics())
+        
         scope = [
             'https://spreadsheets.google.com/feeds',
             'https://www.googleapis.com/auth/drive'
@@ -118,61 +1164,109 @@ def get_google_sheets_client():
         
         if hasattr(client, 'session'):
             client.session.verify = False
+            _configurar_sessao_http(client)
+        
+        # Todas as chamadas à API passam pelo limitador e pelas métricas compartilhados
+        _limit_client_requests(client, get_rate_limiter(), get_metrics())
             
         return client
     except Exception as e:
         st.error(f"Erro na conexão: {str(e)}")
         return None
 
-def get_sheet(sheet_name: str):
+class SheetHandleRegistry:
+    """
+    Registro dos handles de Spreadsheet e Worksheet compartilhado pelo processo.
+    
+    O spreadsheet é aberto e os GIDs configurados são resolvidos uma única vez
+    (duas leituras de metadados); os handles são reutilizados entre reruns e
+    sessões até que uma chamada falhe com erro de não encontrado/permissão.
+    Cada consulta é registrada nas métricas como handle reaproveitado (sem
+    requisição) ou resolvido na API.
+    """
+    
+    def __init__(self, metrics=None):
+        self._lock = threading.Lock()
+        self._metrics = metrics if metrics is not None else SheetsMetrics()
+        self._spreadsheet = None
+        self._worksheets = {}
+    
+    def _resolve(self, client):
+        self._metrics.registrar_handle("resolvido")
+        with self._metrics.rotular("resolver_handles"):
+            spreadsheet = client.open_by_key(SHEET_ID)
+            abas_por_gid = {str(aba.id): aba for aba in spreadsheet.worksheets()}
+        worksheets = {}
+        for nome, gid in SHEET_GIDS.items():
+            if gid in abas_por_gid:
+                worksheets[nome] = abas_por_gid[gid]
+            else:
+                print(f"Erro: Planilha {nome} com GID {gid} não encontrada")
+        self._spreadsheet = spreadsheet
+        self._worksheets = worksheets
+    
+    def spreadsheet(self, client):
+        """Retorna o handle do spreadsheet, resolvendo-o na primeira chamada"""
+        with self._lock:
+            if self._spreadsheet is None:
+                self._resolve(client)
+            else:
+                self._metrics.registrar_handle("acerto")
+            return self._spreadsheet
+    
+    def worksheet(self, client, sheet_name):
+        """Retorna o handle da aba pelo GID configurado (ou pelo nome, como fallback)"""
+        with self._lock:
+            if self._spreadsheet is None:
+                self._resolve(client)
+            elif sheet_name in self._worksheets:
+                self._metrics.registrar_handle("acerto")
+            if sheet_name not in self._worksheets:
+                # Se não tiver GID válido, tenta acessar pelo nome
+                self._metrics.registrar_handle("resolvido")
+                try:
+                    with self._metrics.rotular("resolver_handles", sheet_name):
+                        self._worksheets[sheet_name] = self._spreadsheet.worksheet(sheet_name)
+                except gspread.exceptions.WorksheetNotFound:
+                    print(f"Erro: Planilha {sheet_name} não encontrada")
+                    return None
+            return self._worksheets[sheet_name]
+    
+    def title(self, client, sheet_name):
+        """Retorna o título real da aba, usado para montar intervalos A1"""
+        worksheet = self.worksheet(client, sheet_name)
+        return worksheet.title if worksheet is not None else sheet_name
+    
+    def invalidate(self):
+        """Descarta os handles para que sejam resolvidos novamente"""
+        with self._lock:
+            self._spreadsheet = None
+            self._worksheets = {}
+
+@st.cache_resource
+def get_sheet_registry():
+    return SheetHandleRegistry(get_metrics())
+
+def _is_handle_error(e):
+    """Indica se o erro sugere que os handles em cache estão desatualizados"""
+    if isinstance(e, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound, PermissionError)):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        return getattr(e.response, "status_code", None) in (403, 404)
+    return False
+
+def get_sheet(sheet_name: str, max_retries=3):
     def _get_sheet():
-        try:
-            client = get_google_sheets_client()
-            if client is None:
-                print(f"Erro: Não foi possível conectar ao Google Sheets para a planilha {sheet_name}")
-                return None
-                
-            try:
-                spreadsheet = client.open_by_key(SHEET_ID)
-                
-                # Verificar se a planilha existe usando o GID
-                if sheet_name in SHEET_GIDS:
-                    gid = SHEET_GIDS[sheet_name]
-                    try:
-                        sheet = spreadsheet.get_worksheet_by_id(int(gid))
-                        if sheet is None:
-                            print(f"Erro: Planilha {sheet_name} com GID {gid} não encontrada")
-                            return None
-                        return sheet
-                    except Exception as e:
-                        print(f"Erro ao acessar planilha {sheet_name} com GID {gid}: {str(e)}")
-                        # Tentar acessar pelo nome como fallback
-                        try:
-                            sheet = spreadsheet.worksheet(sheet_name)
-                            return sheet
-                        except:
-                            print(f"Erro: Não foi possível acessar a planilha {sheet_name} nem pelo GID nem pelo nome")
-                            return None
-                else:
-                    # Se não tiver GID, tenta acessar pelo nome
-                    try:
-                        sheet = spreadsheet.worksheet(sheet_name)
-                        return sheet
-                    except Exception as e:
-                        print(f"Erro: Planilha {sheet_name} não encontrada: {str(e)}")
-                        return None
-                        
-            except Exception as e:
-                print(f"Erro ao acessar planilha {sheet_name}: {str(e)}")
-                return None
-                
-        except Exception as e:
-            print(f"Erro ao conectar com Google Sheets para {sheet_name}: {str(e)}")
+        client = get_google_sheets_client()
+        if client is None:
+            print(f"Erro: Não foi possível conectar ao Google Sheets para a planilha {sheet_name}")
             return None
+        
+        return get_sheet_registry().worksheet(client, sheet_name)
             
-    return retry_with_backoff(_get_sheet, max_retries=3, initial_delay=1)
+    return retry_with_backoff(_get_sheet, max_retries=max_retries, initial_delay=1, operacao="get_sheet", planilha=sheet_name)
 
-def retry_with_backoff(func, max_retries=5, initial_delay=1):
+def retry_with_backoff(func, max_retries=5, initial_delay=1, operacao="-", planilha="-", registry=None, metrics=None):
     """
     Executa uma função com retry e exponential backoff
     
@@ -180,14 +1274,28 @@ def retry_with_backoff(func, max_retries=5, initial_delay=1):
         func: Função a ser executada
         max_retries: Número máximo de tentativas
         initial_delay: Delay inicial em segundos
+        operacao, planilha: Identificação usada nas métricas de retentativas
+        registry, metrics: Registro de handles e métricas (padrão: os do processo);
+            informados pelas threads de I/O, que não usam st.cache_resource
         
     Returns:
         Resultado da função ou None se falhar
     """
+    registry = registry if registry is not None else get_sheet_registry()
+    metrics = metrics if metrics is not None else get_metrics()
+    handles_renovados = False
     for attempt in range(max_retries):
         try:
             return func()
         except Exception as e:
+            # Handles desatualizados: renovar o registro e tentar mais uma vez
+            if _is_handle_error(e) and not handles_renovados:
+                print(f"Handles do Google Sheets desatualizados, renovando: {str(e)}")
+                registry.invalidate()
+                handles_renovados = True
+                metrics.registrar_retentativa(operacao, planilha)
+                continue
+            
             if "Quota exceeded" not in str(e):
                 print(f"Erro inesperado: {str(e)}")
                 return None
@@ -202,207 +1310,1076 @@ def retry_with_backoff(func, max_retries=5, initial_delay=1):
             
             # Informar usuário sobre retry
             print(f"Limite de requisições atingido. Tentando novamente em {delay:.1f} segundos...")
+            metrics.registrar_retentativa(operacao, planilha)
             
     return None
 
+class AppendQueue:
+    """
+    Fila write-behind para inclusões de linhas nas planilhas.
+    
+    As linhas são confirmadas imediatamente para o usuário e gravadas por uma
+    thread em segundo plano, que agrupa as pendências de cada planilha em uma
+    única chamada append_rows. Cada linha enfileirada tem um estado visível:
+    "pendente" até ser gravada, "enviando" enquanto a chamada está em
+    andamento ou "falhou" se a gravação não for possível. Só linhas
+    pendentes entram em uma gravação, então a thread e um flush() simultâneo
+    nunca enviam a mesma linha duas vezes.
+    """
+    
+    def __init__(self, client, registry, cache, mirror=None, metrics=None, flush_interval=2.0, quota_delay=10.0):
+        # As dependências compartilhadas são recebidas prontas: funções com
+        # st.cache_resource não reutilizam o cache fora da thread do script
+        self._client = client
+        self._registry = registry
+        self._cache = cache
+        self._mirror = mirror
+        self._metrics = metrics if metrics is not None else SheetsMetrics()
+        self.flush_interval = flush_interval
+        self.quota_delay = quota_delay
+        self._cond = threading.Condition()
+        self._entries = {}
+        self._next_id = 0
+        
+        # Retomar as inclusões que ficaram pendentes no espelho local
+        if mirror is not None:
+            for outbox_id, sheet_name, dados in mirror.outbox():
+                self._add_entry(sheet_name, dados, outbox_id)
+        
+        self._worker = threading.Thread(target=self._run, name="append-queue", daemon=True)
+        self._worker.start()
+    
+    def _add_entry(self, sheet_name, data_dict, outbox_id=None):
+        self._next_id += 1
+        self._entries[self._next_id] = {
+            "id": self._next_id,
+            "sheet_name": sheet_name,
+            "dados": dict(data_dict),
+            "status": "pendente",
+            "erro": "",
+            "criado_em": datetime.now(),
+            "outbox_id": outbox_id
+        }
+        return self._next_id
+    
+    def enqueue(self, sheet_name, data_dict):
+        """Enfileira uma linha e retorna o identificador da pendência"""
+        # Persistir a pendência antes de confirmar, para sobreviver a um reinício
+        outbox_id = self._mirror.outbox_add(sheet_name, data_dict) if self._mirror is not None else None
+        with self._cond:
+            entry_id = self._add_entry(sheet_name, data_dict, outbox_id)
+            self._cond.notify_all()
+            return entry_id
+    
+    def entries(self, ids=None):
+        """Retorna uma cópia das pendências (todas ou apenas os ids informados)"""
+        with self._cond:
+            return [dict(e) for id_, e in self._entries.items() if ids is None or id_ in ids]
+    
+    def pending_frame(self, sheet_name):
+        """DataFrame com as linhas ainda não gravadas de uma planilha"""
+        with self._cond:
+            linhas = [e["dados"] for e in self._entries.values() if e["sheet_name"] == sheet_name]
+        return _rows_to_frame(linhas, sheet_name)
+    
+    def retry_failed(self, ids=None):
+        """Recoloca as linhas que falharam na fila"""
+        with self._cond:
+            for id_, e in self._entries.items():
+                if e["status"] == "falhou" and (ids is None or id_ in ids):
+                    e["status"] = "pendente"
+                    e["erro"] = ""
+            self._cond.notify_all()
+    
+    def discard(self, entry_id):
+        """Descarta uma linha que falhou (a planilha dela é recarregada do servidor na próxima leitura)"""
+        with self._cond:
+            entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            if self._mirror is not None:
+                self._mirror.outbox_remove([entry["outbox_id"]])
+            self._cache.expire(entry["sheet_name"])
+    
+    def flush(self, sheet_name=None, timeout=None):
+        """
+        Grava imediatamente as pendências (de uma planilha ou de todas)
+        
+        Gravações já em andamento na thread não são reenviadas: o flush espera
+        que terminem, por no máximo `timeout` segundos (None: sem limite).
+        
+        Returns:
+            bool: True se nenhuma linha ficou pendente ou em andamento (uma
+            linha devolvida à fila por quota conta como não gravada)
+        """
+        with self._cond:
+            grupos = self._pending_groups(sheet_name)
+        for nome, ids in grupos.items():
+            self._write(nome, ids)
+        with self._cond:
+            self._cond.wait_for(lambda: not self._has_status(sheet_name, ("enviando",)), timeout)
+            return not self._has_status(sheet_name, ("pendente", "enviando"))
+    
+    def failed(self, sheet_name=None):
+        """Indica se há linhas que falharam (de uma planilha ou de todas) aguardando nova tentativa ou descarte"""
+        with self._cond:
+            return self._has_status(sheet_name, ("falhou",))
+    
+    def _pending_groups(self, sheet_name=None):
+        grupos = {}
+        for id_, e in self._entries.items():
+            if e["status"] == "pendente" and (sheet_name is None or e["sheet_name"] == sheet_name):
+                grupos.setdefault(e["sheet_name"], []).append(id_)
+        return grupos
+    
+    def _has_status(self, sheet_name, estados):
+        return any(
+            e["status"] in estados and (sheet_name is None or e["sheet_name"] == sheet_name)
+            for e in self._entries.values()
+        )
+    
+    def _write(self, sheet_name, ids):
+        # Marcar as linhas como em andamento antes de soltar o lock, para que
+        # outra gravação simultânea não as selecione de novo
+        with self._cond:
+            ids = [id_ for id_ in ids if id_ in self._entries and self._entries[id_]["status"] == "pendente"]
+            for id_ in ids:
+                self._entries[id_]["status"] = "enviando"
+            linhas = [list(self._entries[id_]["dados"].values()) for id_ in ids]
+        if not linhas:
+            return True
+        
+        try:
+            if self._client is None:
+                raise ValueError("Não foi possível conectar ao Google Sheets")
+            sheet = self._registry.worksheet(self._client, sheet_name)
+            if sheet is None:
+                raise ValueError(f"Planilha '{sheet_name}' não encontrada.")
+            with self._metrics.rotular("append_rows", sheet_name):
+                sheet.append_rows(linhas)
+        except Exception as e:
+            if "Quota exceeded" in str(e):
+                # Volta a pendente; a thread tenta novamente após o intervalo
+                print(f"Limite de requisições atingido ao gravar {sheet_name}. Nova tentativa em {self.quota_delay:.0f} segundos...")
+                with self._cond:
+                    for id_ in ids:
+                        if id_ in self._entries:
+                            self._entries[id_]["status"] = "pendente"
+                    self._cond.notify_all()
+                return False
+            if _is_handle_error(e):
+                self._registry.invalidate()
+            print(f"Erro ao gravar {len(linhas)} linha(s) em {sheet_name}: {str(e)}")
+            with self._cond:
+                for id_ in ids:
+                    if id_ in self._entries:
+                        self._entries[id_]["status"] = "falhou"
+                        self._entries[id_]["erro"] = str(e)
+                self._cond.notify_all()
+            return True
+        
+        with self._cond:
+            gravadas = [self._entries.pop(id_, None) for id_ in ids]
+            self._cond.notify_all()
+        if self._mirror is not None:
+            self._mirror.outbox_remove([e["outbox_id"] for e in gravadas if e is not None])
+        return True
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending_groups():
+                    self._cond.wait()
+            
+            # Aguardar um pouco para agrupar inclusões simultâneas
+            time.sleep(self.flush_interval)
+            
+            with self._cond:
+                grupos = self._pending_groups()
+            for sheet_name, ids in grupos.items():
+                if not self._write(sheet_name, ids):
+                    time.sleep(self.quota_delay)
+
+@st.cache_resource
+def get_append_queue():
+    return AppendQueue(get_google_sheets_client(), get_sheet_registry(), get_shared_cache(), get_local_mirror(), get_metrics())
+
+def _rows_to_frame(linhas, sheet_name):
+    """Converte dicionários de linhas em DataFrame no formato das planilhas carregadas"""
+    df = pd.DataFrame(linhas)
+    if sheet_name in COLUNAS_ESPERADAS:
+        df = df.reindex(columns=COLUNAS_ESPERADAS[sheet_name])
+    return _aplicar_esquema(df, sheet_name)
+
 def append_to_sheet(data_dict, sheet_name):
     """
     Adiciona uma nova linha de dados à planilha especificada.
     
+    A linha é incluída imediatamente no cache compartilhado e enfileirada
+    para gravação em segundo plano (ver AppendQueue).
+    
     Args:
         data_dict (dict): Dicionário com os dados a serem adicionados
         sheet_name (str): Nome da planilha onde adicionar os dados
         
+    Returns:
+        bool: True se a linha foi aceita para gravação, False caso contrário
+    """
+    try:
+        # Verificar se há dados para adicionar
+        if not data_dict:
+            st.error("Nenhum dado para adicionar.")
+            return False
+        
+        # Enfileirar a gravação e guardar o identificador na sessão para exibir o estado
+        entry_id = get_append_queue().enqueue(sheet_name, data_dict)
+        st.session_state.setdefault("gravacoes_enfileiradas", []).append(entry_id)
+        
+        # Atualizar o cache compartilhado e os dados locais
+        nova_linha = _rows_to_frame([data_dict], sheet_name)
+        cache = get_shared_cache()
+        cache.append(sheet_name, nova_linha)
+        if sheet_name.lower() in st.session_state.local_data:
+            atualizado = cache.peek(sheet_name)
+            if atualizado is None:
+                atualizado = _aplicar_esquema(
+                    pd.concat([st.session_state.local_data[sheet_name.lower()], nova_linha], ignore_index=True),
+                    sheet_name
+                )
+            st.session_state.local_data[sheet_name.lower()] = atualizado
+        
+        return True
+        
+    except Exception as e:
+        st.error(f"Erro ao adicionar dados: {str(e)}")
+        return False
+
+def mostrar_status_gravacoes():
+    """Exibe na barra lateral o estado das linhas enfileiradas por esta sessão"""
+    ids = st.session_state.get("gravacoes_enfileiradas", [])
+    if not ids:
+        return
+    
+    fila = get_append_queue()
+    entries = fila.entries(ids)
+    
+    # Esquecer as linhas já gravadas
+    st.session_state.gravacoes_enfileiradas = [e["id"] for e in entries]
+    
+    pendentes = [e for e in entries if e["status"] in ("pendente", "enviando")]
+    falhas = [e for e in entries if e["status"] == "falhou"]
+    
+    if pendentes:
+        st.sidebar.info(f"⏳ {len(pendentes)} registro(s) aguardando gravação na planilha")
+    
+    for e in falhas:
+        st.sidebar.error(f"Falha ao gravar registro em {e['sheet_name']}: {e['erro']}")
+        col1, col2 = st.sidebar.columns(2)
+        with col1:
+            if st.button("Tentar novamente", key=f"retry_gravacao_{e['id']}"):
+                fila.retry_failed([e["id"]])
+                st.rerun()
+        with col2:
+            if st.button("Descartar", key=f"descartar_gravacao_{e['id']}"):
+                fila.discard(e["id"])
+                st.rerun()
+
+def _diagnostico(diagnosticos, nivel, planilha, mensagem):
+    """
+    Registra um aviso ("warning") ou erro ("error") da carga de dados.
+    
+    As funções de carga rodam fora da thread do script e não chamam o
+    Streamlit; os diagnósticos são exibidos depois por mostrar_diagnosticos.
+    """
+    print(f"{'Erro' if nivel == 'error' else 'Aviso'} ({planilha}): {mensagem}")
+    if diagnosticos is not None:
+        diagnosticos.append({"nivel": nivel, "planilha": planilha, "mensagem": mensagem})
+
+def mostrar_diagnosticos(diagnosticos):
+    """Exibe na página os diagnósticos de uma carga (sem repetir mensagens iguais)"""
+    exibidos = set()
+    for d in diagnosticos or []:
+        chave = (d["nivel"], d["mensagem"])
+        if chave in exibidos:
+            continue
+        exibidos.add(chave)
+        if d["nivel"] == "error":
+            st.error(d["mensagem"])
+        else:
+            st.warning(d["mensagem"])
+
+def _records_to_dataframe(data, sheet_name: str, diagnosticos=None) -> pd.DataFrame:
+    """
+    Converte os registros de uma planilha em DataFrame, verificando as
+    colunas essenciais; as datas são convertidas depois, em _aplicar_esquema
+    """
+    # Converter para DataFrame com tratamento de erros
+    df = pd.DataFrame(data)
+    
+    # Guardar o cabeçalho real da planilha para detectar mudanças de esquema na escrita
+    df.attrs["cabecalho"] = list(data[0].keys()) if data else []
+
+    # Verificar colunas essenciais
+    required_columns = {
+        "Biologicos": ["Nome", "Classe"],
+        "Quimicos": ["Nome", "Classe"],
+        "Compatibilidades": ["Biologico", "Quimico"],
+        "Solicitacoes": ["Quimico", "Biologico"],
+        "Calculos": ["Biologico", "Quimico"]
+    }
+
+    if sheet_name in required_columns:
+        for col in required_columns[sheet_name]:
+            if col not in df.columns:
+                _diagnostico(diagnosticos, "error", sheet_name, f"Coluna obrigatória '{col}' não encontrada em {sheet_name}")
+                return pd.DataFrame()
+
+    # Garantir que todas as colunas esperadas existam no DataFrame
+    if sheet_name in COLUNAS_ESPERADAS:
+        for coluna in COLUNAS_ESPERADAS[sheet_name]:
+            if coluna not in df.columns:
+                df[coluna] = ""
+
+        # Garantir que o DataFrame tenha apenas as colunas esperadas e na ordem correta
+        df = df.reindex(columns=COLUNAS_ESPERADAS[sheet_name])
+
+    return df
+
+def _values_to_records(values):
+    """
+    Converte a grade bruta de valores (cabeçalho + linhas) em registros,
+    com o mesmo tratamento de get_all_records (números convertidos e
+    células vazias como "")
+    """
+    if not values:
+        return []
+    
+    cabecalho = values[0]
+    registros = []
+    for linha in values[1:]:
+        # A API omite as células vazias no final de cada linha
+        linha = linha + [""] * (len(cabecalho) - len(linha))
+        registros.append(dict(zip(cabecalho, gspread.utils.numericise_all(linha))))
+    return registros
+
+def _serialize_cell(value):
+    """Converte um valor do DataFrame para o formato enviado (e comparado) na planilha"""
+    # Texto e float (inclusive np.float64) são os casos mais comuns
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        if value != value:
+            return ""
+        return int(value) if value.is_integer() else float(value)
+    if value is None or value is pd.NaT:
+        return ""
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return ""
+        return int(value) if float(value).is_integer() else float(value)
+    return value
+
+def _frame_to_rows(df: pd.DataFrame, sheet_name: str):
+    """Converte o DataFrame nas linhas de valores da planilha, na ordem de COLUNAS_ESPERADAS"""
+    colunas = COLUNAS_ESPERADAS[sheet_name]
+    df = df.reindex(columns=colunas)
+    
+    # Datas vão em ISO; as que ainda estiverem em texto passam pelo mesmo
+    # parser da carga e, se não forem reconhecidas, são escritas como vieram
+    if "Data" in df.columns:
+        originais = df["Data"]
+        datas = parse_date_series(originais, sheet_name)
+        df["Data"] = datas.dt.strftime('%Y-%m-%d').fillna("")
+        if not pd.api.types.is_datetime64_any_dtype(originais):
+            df["Data"] = df["Data"].where(datas.notna() | originais.isna(), originais)
+    
+    return [[_serialize_cell(valor) for valor in linha] for linha in df.itertuples(index=False, name=None)]
+
+def _diff_ranges(antigas, novas, n_colunas):
+    """
+    Calcula os intervalos mínimos para transformar as linhas antigas nas novas.
+    
+    Linhas alteradas geram um intervalo com as células entre a primeira e a
+    última coluna modificada; linhas novas são gravadas em um único bloco
+    após a última linha e as linhas removidas do final são esvaziadas.
+    
+    Returns:
+        list: Intervalos no formato aceito por Worksheet.batch_update
+    """
+    intervalos = []
+    
+    for i, (antiga, nova) in enumerate(zip(antigas, novas)):
+        alteradas = [j for j in range(n_colunas) if antiga[j] != nova[j]]
+        if alteradas:
+            linha = i + 2  # +1 para o cabeçalho e +1 para o índice base 1
+            inicio, fim = alteradas[0], alteradas[-1]
+            intervalos.append({
+                "range": f"{gspread.utils.rowcol_to_a1(linha, inicio + 1)}:{gspread.utils.rowcol_to_a1(linha, fim + 1)}",
+                "values": [nova[inicio:fim + 1]]
+            })
+    
+    if len(novas) > len(antigas):
+        # Linhas adicionadas
+        inicio = len(antigas) + 2
+        intervalos.append({
+            "range": f"A{inicio}:{gspread.utils.rowcol_to_a1(len(novas) + 1, n_colunas)}",
+            "values": novas[len(antigas):]
+        })
+    elif len(novas) < len(antigas):
+        # Linhas removidas do final
+        inicio = len(novas) + 2
+        intervalos.append({
+            "range": f"A{inicio}:{gspread.utils.rowcol_to_a1(len(antigas) + 1, n_colunas)}",
+            "values": [[""] * n_colunas for _ in range(len(antigas) - len(novas))]
+        })
+    
+    return intervalos
+
+# Espera máxima (em segundos) do script em cada etapa de um salvamento: a
+# gravação das inclusões pendentes e a fila do limitador
+GRAVACAO_ESPERA_MAXIMA = 5
+
+def update_sheet(df: pd.DataFrame, sheet_name: str) -> bool:
+    """
+    Grava o DataFrame na planilha enviando apenas as células alteradas.
+    
+    O DataFrame é comparado com o último estado conhecido do servidor (cache
+    compartilhado). Se o esquema mudou, ou não há estado conhecido, a tabela
+    inteira é regravada sem limpar a planilha antes.
+    
+    A gravação é síncrona, mas as esperas são limitadas: inclusões
+    pendentes e a fila do limitador aguardam no máximo
+    GRAVACAO_ESPERA_MAXIMA segundos cada, e há no máximo uma retentativa
+    por quota. Se um limite estourar, o salvamento é interrompido e o
+    usuário é avisado para tentar de novo.
+    
+    Args:
+        df (pd.DataFrame): Dados completos da planilha
+        sheet_name (str): Nome da planilha
+        
     Returns:
         bool: True se a operação foi bem-sucedida, False caso contrário
     """
-    def _append(data_dict=data_dict, sheet_name=sheet_name):
-        try:
-            # Obter a planilha
-            sheet = get_sheet(sheet_name)
-            if not sheet:
-                st.error(f"Planilha '{sheet_name}' não encontrada.")
+    try:
+        # Nenhuma requisição do salvamento espera mais que o limite na fila do limitador
+        with get_rate_limiter().limitar_espera(GRAVACAO_ESPERA_MAXIMA):
+            # A base do diff (cache) inclui as linhas enfileiradas; só é o estado
+            # do servidor se todas elas já foram gravadas. Linhas que falharam
+            # ou continuam pendentes seriam gravadas pelo diff e depois de novo
+            # pela fila
+            fila = get_append_queue()
+            if not fila.flush(sheet_name, timeout=GRAVACAO_ESPERA_MAXIMA):
+                st.warning("Ainda há registros novos sendo gravados nesta planilha. Tente salvar novamente em instantes.")
+                return False
+            if fila.failed(sheet_name):
+                st.warning("Há registros novos desta planilha que não puderam ser gravados. Eles precisam ser gravados novamente ou descartados antes de salvar.")
                 return False
             
-            # Verificar se há dados para adicionar
-            if not data_dict:
-                st.error("Nenhum dado para adicionar.")
+            worksheet = get_sheet(sheet_name, max_retries=2)
+            if worksheet is None:
                 return False
             
-            # Adicionar os dados à planilha
-            sheet.append_row(list(data_dict.values()))
+            colunas = COLUNAS_ESPERADAS[sheet_name]
+            novas = _frame_to_rows(df, sheet_name)
+            base = get_shared_cache().peek(sheet_name)
+            metrics = get_metrics()
             
-            # Atualizar os dados locais também
-            nova_linha = pd.DataFrame([data_dict])
-            if sheet_name.lower() in st.session_state.local_data:
-                st.session_state.local_data[sheet_name.lower()] = pd.concat(
-                    [st.session_state.local_data[sheet_name.lower()], nova_linha], 
-                    ignore_index=True
-                )
+            if base is not None and base.attrs.get("cabecalho") == colunas:
+                # Mesmo esquema: enviar somente as diferenças
+                intervalos = _diff_ranges(_frame_to_rows(base, sheet_name), novas, len(colunas))
+                if intervalos:
+                    with metrics.rotular("batch_update", sheet_name):
+                        worksheet.batch_update(intervalos, value_input_option='USER_ENTERED')
+            else:
+                # Esquema alterado: regravar tudo e só então remover as linhas excedentes
+                with metrics.rotular("update", sheet_name):
+                    worksheet.update([colunas] + novas, value_input_option='USER_ENTERED')
+                excedentes = []
+                if worksheet.row_count > len(novas) + 1:
+                    excedentes.append(f"{len(novas) + 2}:{worksheet.row_count}")
+                if worksheet.col_count > len(colunas):
+                    excedentes.append(
+                        f"{gspread.utils.rowcol_to_a1(1, len(colunas) + 1)}:"
+                        f"{gspread.utils.rowcol_to_a1(len(novas) + 1, worksheet.col_count)}"
+                    )
+                if excedentes:
+                    with metrics.rotular("batch_clear", sheet_name):
+                        worksheet.batch_clear(excedentes)
             
+            # Atualizar cache compartilhado e local com o estado gravado
+            df = _aplicar_esquema(df, sheet_name)
+            df.attrs["cabecalho"] = colunas
+            get_shared_cache().set(sheet_name, df)
+            mirror = get_local_mirror()
+            if mirror is not None:
+                mirror.replace(sheet_name, df)
+            st.session_state.local_data[sheet_name.lower()] = get_shared_cache().peek(sheet_name)
             return True
             
-        except Exception as e:
-            st.error(f"Erro ao adicionar dados: {str(e)}")
-            return False
-            
-    return retry_with_backoff(_append, max_retries=5, initial_delay=2)
+    except RateLimitExceeded:
+        st.warning("Muitas gravações na planilha neste momento. Tente salvar novamente em instantes.")
+        return False
+    except Exception as e:
+        if _is_handle_error(e):
+            get_sheet_registry().invalidate()
+        st.error(f"Erro ao atualizar planilha: {str(e)}")
+        return False
 
-def load_sheet_data(sheet_name: str) -> pd.DataFrame:
-    def _load(sheet_name=sheet_name):
+@st.cache_resource
+def get_io_executor():
+    """Executor do processo para as chamadas de I/O ao Google Sheets"""
+    return ThreadPoolExecutor(max_workers=SHEETS_IO_WORKERS, thread_name_prefix="sheets-io")
+
+class SheetsRefresher:
+    """Agenda recargas no executor de I/O, com no máximo uma em andamento por conjunto de planilhas"""
+    
+    def __init__(self, executor):
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._futures = {}
+    
+    def submit(self, sheet_names, task):
+        """Retorna a recarga em andamento para estas planilhas ou agenda uma nova"""
+        chave = tuple(sorted(sheet_names))
+        with self._lock:
+            future = self._futures.get(chave)
+            if future is None or future.done():
+                future = self._executor.submit(task)
+                self._futures[chave] = future
+            return future
+    
+    def running(self):
+        """Indica se há alguma recarga em andamento"""
+        with self._lock:
+            return any(not future.done() for future in self._futures.values())
+
+@st.cache_resource
+def get_refresher():
+    return SheetsRefresher(get_io_executor())
+
+# Intervalo usado nas chaves do SingleFlight para a leitura da planilha inteira
+INTERVALO_COMPLETO = "*"
+
+class SingleFlight:
+    """
+    Coalescência de leituras concorrentes ("single-flight").
+    
+    Enquanto a leitura de uma chave (planilha, intervalo) está em andamento,
+    novos pedidos da mesma chave esperam por ela e recebem o mesmo resultado,
+    em vez de repetir a chamada ao Google Sheets. Quem reserva uma chave deve
+    sempre concluí-la (com resultado ou erro) antes de esperar por outras.
+    """
+    
+    def __init__(self, metrics=None):
+        self._metrics = metrics if metrics is not None else SheetsMetrics()
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+    
+    def reservar(self, chaves, operacao="-"):
+        """
+        Separa as chaves entre as que o chamador deve buscar (reservadas para
+        ele) e as que já estão sendo buscadas por outro
+        
+        Returns:
+            tuple: (lista de chaves reservadas, {chave: Future da leitura em andamento})
+        """
+        minhas, alheias = [], {}
+        with self._lock:
+            for chave in chaves:
+                future = self._em_andamento.get(chave)
+                if future is None:
+                    self._em_andamento[chave] = Future()
+                    minhas.append(chave)
+                else:
+                    alheias[chave] = future
+        for planilha, _ in alheias:
+            self._metrics.registrar_coalescida(operacao, planilha)
+        return minhas, alheias
+    
+    def concluir(self, chave, resultado=None, erro=None):
+        """Entrega o resultado (ou o erro) da chave a quem estiver esperando e libera a reserva"""
+        with self._lock:
+            future = self._em_andamento.pop(chave, None)
+        if future is None:
+            return
+        if erro is not None:
+            future.set_exception(erro)
+        else:
+            future.set_result(resultado)
+    
+    def executar(self, chave, func, operacao="-"):
+        """Executa func para a chave, ou espera a execução já em andamento e devolve o mesmo resultado"""
+        minhas, alheias = self.reservar([chave], operacao)
+        if alheias:
+            return alheias[chave].result()
         try:
-            worksheet = get_sheet(sheet_name)
-            if worksheet is None:
-                st.warning(f"Planilha {sheet_name} não encontrada")
-                return pd.DataFrame()
-            
+            resultado = func()
+        except BaseException as e:
+            self.concluir(chave, erro=e)
+            raise
+        self.concluir(chave, resultado)
+        return resultado
+
+# Edições que escapem à impressão (colisão do checksum) só são vistas na
+# recarga completa, feita ao menos a cada tantos segundos
+RECARGA_COMPLETA_SEGUNDOS = float(os.environ.get("EXPERIMENTOS_RECARGA_COMPLETA", CACHE_TTL_SEGUNDOS * 6))
+
+def _impressao(valores):
+    """
+    Impressão de uma aba para a detecção de mudanças: número de linhas e
+    checksum de todos os valores da faixa usada, normalizados como a API os
+    devolve
+    
+    Args:
+        valores (list): Linhas lidas da aba
+    """
+    linhas = _grid_values(valores)
+    return len(linhas), hash(tuple(map(tuple, linhas)))
+
+class SheetsLoader:
+    """
+    Leitura e normalização das planilhas, sem nenhuma chamada ao Streamlit.
+    
+    Roda nas threads de I/O: as dependências compartilhadas são recebidas
+    prontas e os avisos e erros são devolvidos como diagnósticos (ver
+    _diagnostico), que a thread do script exibe uma única vez. As cargas
+    individuais de cada planilha usam um executor próprio, de vida longa.
+    Leituras simultâneas da mesma planilha, vindas de sessões diferentes,
+    são coalescidas em uma só (ver SingleFlight). Antes de baixar, a recarga
+    consulta a revisão do arquivo para pular as planilhas que não mudaram (ver
+    alteradas).
+    """
+    
+    def __init__(self, client, registry, metrics, formatos=None):
+        self._client = client
+        self._registry = registry
+        self._metrics = metrics
+        # Formatos de data detectados por planilha (ver get_formatos_data)
+        self._formatos = formatos if formatos is not None else {}
+        self._executor = ThreadPoolExecutor(max_workers=len(SHEET_GIDS), thread_name_prefix="sheets-loader")
+        self._voos = SingleFlight(metrics)
+    
+    def _retry(self, func, operacao, planilha):
+        return retry_with_backoff(func, operacao=operacao, planilha=planilha, registry=self._registry, metrics=self._metrics)
+    
+    def fetch_sheet(self, sheet_name, diagnosticos=None):
+        """Carrega uma planilha com get_all_records; retorna um DataFrame (vazio se falhar)"""
+        return self._voos.executar(
+            (sheet_name, INTERVALO_COMPLETO),
+            partial(self._fetch_sheet, sheet_name, diagnosticos),
+            "get_all_records"
+        )
+    
+    def _fetch_sheet(self, sheet_name, diagnosticos=None):
+        def _load():
             try:
-                data = worksheet.get_all_records()
-                if not data:
-                    st.warning(f"A planilha {sheet_name} está vazia")
+                if self._client is None:
+                    _diagnostico(diagnosticos, "error", sheet_name, "Não foi possível conectar ao Google Sheets")
+                    return pd.DataFrame()
+                
+                worksheet = self._registry.worksheet(self._client, sheet_name)
+                if worksheet is None:
+                    _diagnostico(diagnosticos, "warning", sheet_name, f"Planilha {sheet_name} não encontrada")
                     return pd.DataFrame()
-            except gspread.exceptions.APIError as e:
-                st.error(f"Erro na API: {str(e)}")
+                
+                try:
+                    with self._metrics.rotular("get_all_records", sheet_name):
+                        data = worksheet.get_all_records()
+                    if not data:
+                        _diagnostico(diagnosticos, "warning", sheet_name, f"A planilha {sheet_name} está vazia")
+                        return pd.DataFrame()
+                except gspread.exceptions.APIError as e:
+                    if _is_handle_error(e) or "Quota exceeded" in str(e):
+                        raise
+                    _diagnostico(diagnosticos, "error", sheet_name, f"Erro na API: {str(e)}")
+                    return pd.DataFrame()
+                
+                return _records_to_dataframe(data, sheet_name, diagnosticos)
+            
+            except Exception as e:
+                # Deixar o retry renovar os handles ou aguardar a quota
+                if _is_handle_error(e) or "Quota exceeded" in str(e):
+                    raise
+                _diagnostico(diagnosticos, "error", sheet_name, f"Erro crítico ao carregar {sheet_name}: {str(e)}")
                 return pd.DataFrame()
-
-            # Converter para DataFrame com tratamento de erros
-            df = pd.DataFrame(data)
+        
+        df = self._retry(_load, "get_all_records", sheet_name)
+        if df is None:
+            _diagnostico(diagnosticos, "error", sheet_name, f"Não foi possível carregar {sheet_name}. Tente novamente mais tarde.")
+        return df
+    
+    def fetch_batch(self, sheet_names, diagnosticos=None):
+        """
+        Carrega várias planilhas em uma única requisição values:batchGet.
+        
+        Args:
+            sheet_names (list): Nomes das planilhas a carregar; as que não
+                estiverem em SHEET_GIDS são ignoradas
+            diagnosticos (list): Lista onde registrar avisos e erros
             
-            # Tratamento específico para colunas de data
-            if 'Data' in df.columns and not df.empty:
-                # Tentar converter para o formato padrão DD/MM/YYYY
-                try:
-                    # Primeiro verificar se já está no formato datetime
-                    if pd.api.types.is_datetime64_any_dtype(df['Data']):
-                        df['Data'] = df['Data'].dt.strftime('%d/%m/%Y')
-                    else:
-                        # Tentar diferentes formatos de data
-                        for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y']:
-                            try:
-                                temp_dates = pd.to_datetime(df['Data'], format=fmt, errors='coerce')
-                                if not temp_dates.isna().all():  # Se conseguiu converter algumas datas
-                                    df['Data'] = temp_dates.dt.strftime('%d/%m/%Y')
-                                    break
-                            except:
-                                continue
-                except Exception as e:
-                    st.warning(f"Erro ao processar datas na planilha {sheet_name}: {str(e)}")
+        Returns:
+            dict: Nome da planilha -> DataFrame normalizado, só das planilhas
+            carregadas; as que falharam (na leitura própria ou na de outra
+            sessão aproveitada) ficam de fora
+        """
+        nomes = [nome for nome in sheet_names if nome in SHEET_GIDS]
+        if not nomes:
+            return {}
+        
+        # Planilhas que outra sessão já está lendo não entram no lote: o
+        # resultado daquela leitura é aproveitado
+        minhas, alheias = self._voos.reservar([(nome, INTERVALO_COMPLETO) for nome in nomes], "values_batch_get")
+        try:
+            dados = self._fetch_batch([nome for nome, _ in minhas], diagnosticos) if minhas else {}
+        except BaseException as e:
+            for chave in minhas:
+                self._voos.concluir(chave, erro=e)
+            raise
+        dados = dados if dados is not None else {}
+        for chave in minhas:
+            self._voos.concluir(chave, dados.get(chave[0]))
+        
+        # Uma leitura aproveitada que falhou não descarta as demais
+        for (nome, _), future in alheias.items():
+            try:
+                df = future.result()
+            except Exception:
+                continue
+            if df is not None:
+                dados[nome] = df
+        return dados
+    
+    def _fetch_batch(self, nomes, diagnosticos=None):
+        valores = self._fetch_valores(nomes, "values_batch_get")
+        if valores is None:
+            return None
+        return {nome: self._montar_frame(nome, valores[nome], diagnosticos) for nome in nomes}
+    
+    def _fetch_valores(self, nomes, operacao):
+        """
+        Lê a faixa usada de várias planilhas em uma única requisição values:batchGet
+        
+        Returns:
+            dict: Nome da planilha -> linhas de valores, ou None se falhar
+        """
+        def _batch_get():
+            # Handles e títulos das abas vêm do registro compartilhado
+            spreadsheet = self._registry.spreadsheet(self._client)
+            titulos = {nome: self._registry.title(self._client, nome) for nome in nomes}
             
-            # Verificar colunas essenciais
-            required_columns = {
-                "Biologicos": ["Nome", "Classe"],
-                "Quimicos": ["Nome", "Classe"],
-                "Compatibilidades": ["Biologico", "Quimico"],
-                "Solicitacoes": ["Quimico", "Biologico"],
-                "Calculos": ["Biologico", "Quimico"]
+            # Uma única requisição para todos os intervalos
+            ranges = [gspread.utils.absolute_range_name(titulos[nome]) for nome in nomes]
+            with self._metrics.rotular(operacao, ", ".join(nomes)):
+                resposta = spreadsheet.values_batch_get(ranges)
+            return {
+                nome: value_range.get("values", [])
+                for nome, value_range in zip(nomes, resposta.get("valueRanges", []))
             }
-            
-            if sheet_name in required_columns:
-                for col in required_columns[sheet_name]:
-                    if col not in df.columns:
-                        st.error(f"Coluna obrigatória '{col}' não encontrada em {sheet_name}")
-                        return pd.DataFrame()
-                        
-            # Garantir que todas as colunas esperadas existam no DataFrame
-            if sheet_name in COLUNAS_ESPERADAS:
-                for coluna in COLUNAS_ESPERADAS[sheet_name]:
-                    if coluna not in df.columns:
-                        df[coluna] = ""
-                
-                # Garantir que o DataFrame tenha apenas as colunas esperadas e na ordem correta
-                df = df.reindex(columns=COLUNAS_ESPERADAS[sheet_name])
-                        
-            return df
-
+        
+        if self._client is None:
+            print("Erro: Não foi possível conectar ao Google Sheets para a leitura em lote")
+            return None
+        return self._retry(_batch_get, operacao, ", ".join(nomes))
+    
+    def _montar_frame(self, nome, valores, diagnosticos=None):
+        """DataFrame de uma planilha a partir das linhas lidas, com a impressão dos valores em attrs"""
+        registros = _values_to_records(valores)
+        if not registros:
+            print(f"Aviso: A planilha {nome} está vazia")
+            df = pd.DataFrame()
+        else:
+            df = _records_to_dataframe(registros, nome, diagnosticos)
+        df.attrs["impressao"] = _impressao(valores)
+        return df
+    
+    def revisao(self):
+        """Revisão do arquivo (modifiedTime no Drive) ou None se não for possível consultá-la"""
+        if self._client is None:
+            return None
+        try:
+            spreadsheet = self._registry.spreadsheet(self._client)
+            with self._metrics.rotular("get_lastUpdateTime"):
+                return spreadsheet.get_lastUpdateTime()
         except Exception as e:
-            st.error(f"Erro crítico ao carregar {sheet_name}: {str(e)}")
-            return pd.DataFrame()
+            print(f"Aviso: Não foi possível consultar a revisão da planilha: {str(e)}")
+            return None
+    
+    def alteradas(self, sheet_names, cache):
+        """
+        Descobre quais planilhas mudaram desde a carga em cache.
+        
+        Primeiro compara a revisão do arquivo no Drive (que não consome a
+        quota do Sheets) com a gravada na carga; se for a mesma, nada mudou.
+        Se mudou, as planilhas suspeitas são lidas em uma única requisição e
+        suas impressões (número de linhas e checksum de toda a faixa usada)
+        comparadas às da carga. Os valores das que mudaram são devolvidos
+        para que a recarga não as baixe de novo. Planilhas sem dados ou
+        impressão em cache, ou carregadas há mais de
+        RECARGA_COMPLETA_SEGUNDOS, sempre contam como alteradas.
+        
+        A revisão é consultada mesmo quando nenhuma planilha tem impressão
+        (carga a frio), para ser gravada com a carga.
         
-    return retry_with_backoff(_load)
+        Returns:
+            tuple: (planilhas a recarregar, revisão atual do arquivo ou None,
+            dict com os valores já lidos de parte das planilhas a recarregar)
+        """
+        agora = time.monotonic()
+        revisao = self.revisao()
+        alteradas, impressoes_cache, valores = [], {}, {}
+        for nome in sheet_names:
+            df = cache.peek(nome)
+            attrs = df.attrs if df is not None else {}
+            if "impressao" not in attrs or agora - attrs.get("carregado_em", float("-inf")) >= RECARGA_COMPLETA_SEGUNDOS:
+                alteradas.append(nome)
+            elif revisao is None or attrs.get("revisao") != revisao:
+                impressoes_cache[nome] = attrs["impressao"]
+        
+        if impressoes_cache:
+            lidos = self._fetch_valores(list(impressoes_cache), "verificar_alteracoes") or {}
+            for nome, impressao in impressoes_cache.items():
+                if nome not in lidos:
+                    alteradas.append(nome)
+                elif _impressao(lidos[nome]) != impressao:
+                    alteradas.append(nome)
+                    valores[nome] = lidos[nome]
+        return alteradas, revisao, valores
+    
+    def refresh(self, sheet_names, cache, fila, mirror=None):
+        """
+        Busca as planilhas que mudaram e grava o resultado no cache compartilhado.
+        
+        As planilhas que não mudaram (ver alteradas) só têm a validade
+        renovada, e as que mudaram e já foram lidas na verificação são
+        montadas a partir desses valores. As planilhas que a leitura em lote
+        não trouxer (falha própria ou de uma leitura aproveitada de outra
+        sessão) são mantidas como estão se já têm dados, mesmo expirados, e
+        as demais são carregadas uma a uma, em paralelo. Leituras em lote
+        bem-sucedidas também atualizam o espelho local.
+        
+        Returns:
+            list: Diagnósticos da carga, para exibição na thread do script
+        """
+        diagnosticos = []
+        nomes, revisao, valores = self.alteradas(sheet_names, cache)
+        for nome in sheet_names:
+            if nome not in nomes:
+                cache.renovar(nome, revisao=revisao)
+        if not nomes:
+            return diagnosticos
+        
+        # As planilhas já lidas na verificação são montadas sem novo download
+        carregado_em = time.monotonic()
+        lote = {nome: self._montar_frame(nome, valores[nome], diagnosticos) for nome in nomes if nome in valores}
+        faltantes = [nome for nome in nomes if nome not in lote]
+        lote.update(self.fetch_batch(faltantes, diagnosticos) if faltantes else {})
+        individuais = [nome for nome in faltantes if nome not in lote and cache.peek(nome) is None]
+        
+        frames = {nome: _load_and_validate_sheet(nome, df, self._formatos) for nome, df in lote.items()}
+        atributos = {
+            nome: {"revisao": revisao, "impressao": df.attrs["impressao"], "carregado_em": carregado_em}
+            for nome, df in lote.items() if "impressao" in df.attrs
+        }
+        futures = {nome: self._executor.submit(self.fetch_sheet, nome, diagnosticos) for nome in individuais}
+        frames.update({nome: _load_and_validate_sheet(nome, future.result(), self._formatos) for nome, future in futures.items()})
+        
+        for nome, df in frames.items():
+            cache.set(nome, df, **atributos.get(nome, {}))
+            cache.append(nome, fila.pending_frame(nome))
+            if mirror is not None and nome in lote:
+                mirror.replace(nome, df)
+        return diagnosticos
 
-def update_sheet(df: pd.DataFrame, sheet_name: str) -> bool:
-    try:
-        worksheet = get_sheet(sheet_name)
-        if worksheet is None:
+@st.cache_resource
+def get_loader():
+    return SheetsLoader(get_google_sheets_client(), get_sheet_registry(), get_metrics(), get_formatos_data())
+
+# Intervalo (em segundos) da atualização agendada do cache; 0 desliga. O
+# padrão fica abaixo do TTL para que as sessões quase nunca vejam dados expirados
+ATUALIZACAO_INTERVALO = float(os.environ.get("EXPERIMENTOS_ATUALIZACAO_INTERVALO", CACHE_TTL_SEGUNDOS * 0.8))
+# Limite do intervalo quando a quota está apertada (o intervalo dobra a cada ciclo)
+ATUALIZACAO_INTERVALO_MAXIMO = ATUALIZACAO_INTERVALO * 8
+# Fração mínima de tokens de leitura no limitador para considerar que há folga de quota
+ATUALIZACAO_FOLGA_QUOTA = 0.25
+
+class BackgroundRefresher:
+    """
+    Mantém o cache compartilhado aquecido (stale-while-revalidate).
+    
+    Uma thread do processo, a cada `intervalo` segundos, agenda no
+    SheetsRefresher a recarga das planilhas cujo dado em cache expiraria
+    antes do próximo ciclo. As sessões continuam recebendo a cópia atual enquanto a recarga
+    roda, então nenhum rerun espera por uma atualização agendada.
+    
+    Se a quota estiver apertada (poucos tokens de leitura no limitador ou
+    novos erros de quota desde o último ciclo), o ciclo é pulado e o
+    intervalo dobra, até `intervalo_maximo`; ele volta ao normal assim que
+    houver folga.
+    """
+    
+    def __init__(self, cache, refresher, loader, fila, mirror=None, limiter=None, metrics=None,
+                 intervalo=ATUALIZACAO_INTERVALO, intervalo_maximo=ATUALIZACAO_INTERVALO_MAXIMO,
+                 folga_minima=ATUALIZACAO_FOLGA_QUOTA, iniciar=True):
+        self._cache = cache
+        self._refresher = refresher
+        self._loader = loader
+        self._fila = fila
+        self._mirror = mirror
+        self._limiter = limiter
+        self._metrics = metrics if metrics is not None else SheetsMetrics()
+        self.intervalo = intervalo
+        self.intervalo_maximo = max(intervalo, intervalo_maximo)
+        self.folga_minima = folga_minima
+        self.intervalo_atual = intervalo
+        self.ultimo_ciclo = None
+        self._erros_quota = self._metrics.total("quota")
+        
+        self._thread = threading.Thread(target=self._run, name="background-refresher", daemon=True)
+        if iniciar and intervalo > 0:
+            self._thread.start()
+    
+    def quota_apertada(self):
+        """Indica se a quota de leitura está sem folga para uma atualização agendada"""
+        erros_quota = self._metrics.total("quota")
+        novos_erros = erros_quota > self._erros_quota
+        self._erros_quota = erros_quota
+        if novos_erros:
+            return True
+        if self._limiter is None:
             return False
-            
-        # Converter todas as datas para string ISO
-        df_copy = df.copy()
-        for col in df_copy.columns:
-            if pd.api.types.is_datetime64_any_dtype(df_copy[col]):
-                df_copy[col] = df_copy[col].dt.strftime('%Y-%m-%d')
-        
-        # Substituir valores NaN por None para compatibilidade com JSON
-        df_copy = df_copy.replace({np.nan: None})
-                
-        # Garantir a ordem das colunas
-        df_copy = df_copy[COLUNAS_ESPERADAS[sheet_name]]
-        
-        # Atualizar toda a planilha
-        worksheet.clear()
-        worksheet.update(
-            [df_copy.columns.values.tolist()] + df_copy.values.tolist(),
-            value_input_option='USER_ENTERED'  # Adicionado para preservar formatos
-        )
+        bucket = self._limiter.buckets["leitura"]
+        return bucket.snapshot()["tokens_disponiveis"] < bucket.capacidade * self.folga_minima
+    
+    def ciclo(self):
+        """
+        Executa um ciclo de atualização
         
-        # Atualizar cache local
-        st.session_state.local_data[sheet_name.lower()] = df
-        return True
+        Returns:
+            list: Planilhas cuja recarga foi agendada (vazia se nada venceu ou se a quota está apertada)
+        """
+        self.ultimo_ciclo = datetime.now()
+        if self.quota_apertada():
+            self.intervalo_atual = min(self.intervalo_atual * 2, self.intervalo_maximo)
+            print(f"Quota apertada: próxima atualização agendada em {self.intervalo_atual:.0f} segundos")
+            return []
         
-    except Exception as e:
-        st.error(f"Erro ao atualizar planilha: {str(e)}")
-        return False
+        # Recarregar agora o que venceria antes do próximo ciclo; comparar só
+        # com o intervalo deixaria cada planilha ser pulada um ciclo sim, outro não
+        self.intervalo_atual = self.intervalo
+        vencidas = [nome for nome in SHEET_GIDS if self._cache.idade(nome) + self.intervalo_atual >= self._cache.ttl]
+        if vencidas:
+            task = partial(self._loader.refresh, vencidas, self._cache, self._fila, self._mirror)
+            self._refresher.submit(vencidas, task)
+        return vencidas
+    
+    def _run(self):
+        while True:
+            time.sleep(self.intervalo_atual)
+            try:
+                self.ciclo()
+            except Exception as e:
+                print(f"Erro na atualização agendada: {str(e)}")
+
+@st.cache_resource
+def get_background_refresher():
+    return BackgroundRefresher(
+        get_shared_cache(), get_refresher(), get_loader(), get_append_queue(),
+        get_local_mirror(), get_rate_limiter(), get_metrics()
+    )
 
 def load_all_data():
     """
     Carrega todos os dados das planilhas e armazena na session_state
-    Usa cache de sessão para minimizar requisições ao Google Sheets
-    """
-    # Verificar se os dados já estão na sessão e se foram carregados há menos de 5 minutos
-    if 'data_timestamp' in st.session_state and 'local_data' in st.session_state:
-        elapsed_time = (datetime.now() - st.session_state.data_timestamp).total_seconds()
-        # Usar dados em cache se foram carregados há menos de 5 minutos
-        if elapsed_time < 300:  # 5 minutos em segundos
-            return st.session_state.local_data
-    
-    # Carregar dados com paralelismo para melhorar a performance
-    with st.spinner("Carregando dados..."):
-        # Inicializar dicionário de dados
-        dados = {}
-        
-        # Definir função para carregar uma planilha específica
-        def load_sheet(sheet_name):
-            return sheet_name, _load_and_validate_sheet(sheet_name)
-        
-        # Usar threads para carregar as planilhas em paralelo
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            # Submeter tarefas para carregar cada planilha
-            futures = {executor.submit(load_sheet, name): name for name in ["Quimicos", "Biologicos", "Compatibilidades", "Solicitacoes", "Calculos"]}
+    Usa um cache compartilhado entre sessões para minimizar requisições ao Google Sheets
+    
+    Planilhas expiradas são servidas como estão enquanto a recarga roda em
+    segundo plano; só há espera quando ainda não existe nenhum dado em cache
+    nem snapshot no espelho local.
+    """
+    cache = get_shared_cache()
+    refresher = get_refresher()
+    mirror = get_local_mirror()
+    sheet_names = list(SHEET_GIDS)
+    # Garante que a atualização agendada do cache está rodando neste processo
+    get_background_refresher()
+    
+    # Exibir os diagnósticos de uma recarga em segundo plano que já terminou
+    recarga = st.session_state.get("recarga_em_andamento")
+    if recarga is not None and recarga.done():
+        del st.session_state.recarga_em_andamento
+        if recarga.exception() is None:
+            mostrar_diagnosticos(recarga.result())
+    
+    # Ao iniciar o processo, usar o snapshot em disco (marcado como expirado para sincronizar)
+    if mirror is not None:
+        for sheet_name in sheet_names:
+            if cache.peek(sheet_name) is None:
+                snapshot = mirror.load(sheet_name)
+                if snapshot is not None:
+                    cache.set(sheet_name, snapshot, expirado=True)
+                    cache.append(sheet_name, get_append_queue().pending_frame(sheet_name))
+    
+    # Buscar no cache compartilhado as planilhas válidas (ou a última versão conhecida)
+    dados = {}
+    faltantes = []
+    expiradas = []
+    metrics = get_metrics()
+    for sheet_name in sheet_names:
+        df = cache.get(sheet_name)
+        if df is None:
+            df = cache.peek(sheet_name)
+            if df is None:
+                faltantes.append(sheet_name)
+                metrics.registrar_cache(sheet_name, "falta")
+                continue
+            expiradas.append(sheet_name)
+            metrics.registrar_cache(sheet_name, "expirado")
+        else:
+            metrics.registrar_cache(sheet_name, "acerto")
+        dados[sheet_name.lower()] = df
+    
+    if faltantes or expiradas:
+        task = partial(get_loader().refresh, faltantes + expiradas, cache, get_append_queue(), mirror)
+        future = refresher.submit(faltantes + expiradas, task)
+        
+        if faltantes:
+            # Sem dados para exibir: aguardar a primeira carga
+            with st.spinner("Carregando dados..."):
+                try:
+                    mostrar_diagnosticos(future.result())
+                except Exception as e:
+                    print(f"Erro ao carregar planilhas: {str(e)}")
             
-            # Coletar resultados à medida que ficam disponíveis
-            for future in concurrent.futures.as_completed(futures):
-                sheet_name, df = future.result()
+            for sheet_name in sheet_names:
+                df = cache.peek(sheet_name)
+                if df is None:
+                    df = _aplicar_esquema(pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name]), sheet_name)
                 dados[sheet_name.lower()] = df
+        else:
+            st.session_state.recarga_em_andamento = future
     
-    # Armazenar dados na sessão com timestamp
+    if refresher.running():
+        st.caption("🔄 Atualizando dados em segundo plano...")
+    
+    # Armazenar na sessão apenas referências aos dados compartilhados
     st.session_state.local_data = dados
-    st.session_state.data_timestamp = datetime.now()
     
     return dados
 
-def _load_and_validate_sheet(sheet_name):
-    """Carrega uma planilha específica e valida suas colunas"""
+def _load_and_validate_sheet(sheet_name, df, formatos=None):
+    """Valida as colunas de uma planilha já carregada e normaliza seus valores"""
     try:
-        # Usar a função original para carregar os dados
-        df = load_sheet_data(sheet_name)
-        
         # Verificar se o DataFrame está vazio
         if df is None or df.empty:
             print(f"Aviso: Planilha '{sheet_name}' está vazia ou não pôde ser carregada.")
             # Criar um DataFrame vazio com as colunas esperadas
             if sheet_name in COLUNAS_ESPERADAS:
-                return pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name])
+                return _aplicar_esquema(pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name]), sheet_name)
             return pd.DataFrame()
         
         # Verificar coluna Nome
@@ -410,21 +2387,13 @@ def _load_and_validate_sheet(sheet_name):
             print(f"Aviso: Coluna 'Nome' não encontrada em {sheet_name}")
             # Criar um DataFrame vazio com as colunas esperadas
             if sheet_name in COLUNAS_ESPERADAS:
-                return pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name])
+                return _aplicar_esquema(pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name]), sheet_name)
             return pd.DataFrame()
             
         # Remover linhas com Nome vazio para planilhas que exigem Nome
         if sheet_name in ["Biologicos", "Quimicos"] and "Nome" in df.columns:
             df = df[df["Nome"].notna()]
         
-        # Converter colunas de data
-        if sheet_name in ["Compatibilidades", "Solicitacoes", "Calculos"] and "Data" in df.columns:
-            try:
-                df["Data"] = pd.to_datetime(df["Data"], errors='coerce')
-                df["Data"] = df["Data"].dt.strftime('%d/%m/%Y')
-            except Exception as e:
-                print(f"Aviso: Erro ao processar datas na planilha {sheet_name}: {str(e)}")
-        
         # Garantir que todas as colunas esperadas existam no DataFrame
         if sheet_name in COLUNAS_ESPERADAS:
             for coluna in COLUNAS_ESPERADAS[sheet_name]:
@@ -434,58 +2403,180 @@ def _load_and_validate_sheet(sheet_name):
             # Garantir que o DataFrame tenha apenas as colunas esperadas e na ordem correta
             df = df.reindex(columns=COLUNAS_ESPERADAS[sheet_name])
             
-            # Garantir que não há valores None/NaN nas colunas de texto
-            for col in df.columns:
-                df[col] = df[col].fillna("")
+            # Tipos definitivos (categorias, números e datas), aplicados só aqui
+            df = _aplicar_esquema(df, sheet_name, formatos)
         
         return df
     except Exception as e:
         print(f"Erro ao carregar planilha {sheet_name}: {str(e)}")
         # Criar um DataFrame vazio com as colunas esperadas
         if sheet_name in COLUNAS_ESPERADAS:
-            return pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name])
+            return _aplicar_esquema(pd.DataFrame(columns=COLUNAS_ESPERADAS[sheet_name]), sheet_name)
         return pd.DataFrame()
 
+def parse_scientific_series(serie):
+    """
+    Converte uma coluna inteira de números em notação científica para float.
+    
+    Aceita "1e9", "1,5e9", "2×10^8" (ou "2x10^8") e espaços soltos, usando
+    apenas operações vetorizadas de string, em uma única passada.
+    
+    Returns:
+        tuple: (valores float64, máscara dos valores preenchidos que não
+            puderam ser convertidos); vazios viram NaN e não são inválidos
+    """
+    serie = pd.Series(serie)
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype("float64"), pd.Series(False, index=serie.index)
+    
+    texto = serie.astype("string").str.replace(r"\s+", "", regex=True)
+    vazio = texto.isna() | (texto == "")
+    texto = (
+        texto.str.replace(",", ".", regex=False)
+             .str.replace(r"[×xX]10\^", "e", regex=True)
+    )
+    valores = pd.to_numeric(texto.where(~vazio), errors="coerce").astype("float64")
+    invalidos = valores.isna() & ~vazio
+    return valores, invalidos.astype(bool)
+
 def convert_scientific_to_float(value):
-    """Converte notação científica em string para float"""
-    try:
-        # Se o valor for vazio ou None, retorna None
-        if pd.isna(value) or value == '' or value is None:
-            return None
-            
-        if isinstance(value, (int, float)):
-            return float(value)
-            
-        # Remove espaços e substitui vírgula por ponto
-        value = str(value).strip().replace(' ', '').replace(',', '.')
-        
-        # Trata notação com 'E' ou 'e'
-        if 'e' in value.lower():
-            try:
-                return float(value)
-            except ValueError:
-                raise ValueError(f"Formato inválido para notação científica: {value}")
-                
-        # Trata notação com ×10^
-        if '×10^' in value:
-            try:
-                base, exponent = value.split('×10^')
-                return float(base) * (10 ** float(exponent))
-            except ValueError:
-                raise ValueError(f"Formato inválido para notação com ×10^: {value}")
-                
-        # Tenta converter diretamente para float
-        try:
-            return float(value)
-        except ValueError:
-            raise ValueError(f"Valor não pode ser convertido para número: {value}")
-            
-    except Exception as e:
-        # Propaga o erro para ser tratado pelo chamador
-        raise ValueError(f"Erro ao converter valor '{value}': {str(e)}")
+    """Converte um único valor em notação científica para float (ver parse_scientific_series)"""
+    valores, invalidos = parse_scientific_series([value])
+    if invalidos.iloc[0]:
+        raise ValueError(f"Valor não pode ser convertido para número: {value}")
+    return None if pd.isna(valores.iloc[0]) else float(valores.iloc[0])
+
+# Formatos aceitos na coluna Data; em caso de empate na detecção vale a
+# ordem da lista (datas como 05/03/2024 são lidas como dia/mês)
+FORMATOS_DATA = ["%d/%m/%Y", "ISO8601", "%m/%d/%Y"]
+# Tamanho da amostra usada para detectar o formato de cada planilha
+AMOSTRA_FORMATO_DATA = 200
+
+@st.cache_resource
+def get_formatos_data():
+    """Formato de data detectado por planilha, reaproveitado entre reruns e nas próximas cargas"""
+    return {}
+
+def _detectar_formato_data(serie, sheet_name=None, formatos=None):
+    """Escolhe o formato de FORMATOS_DATA que converte mais valores de uma amostra da coluna"""
+    formato = formatos.get(sheet_name) if formatos is not None else None
+    if formato is not None:
+        return formato
+    
+    amostra = serie[serie.notna()].head(AMOSTRA_FORMATO_DATA)
+    acertos = {fmt: pd.to_datetime(amostra, format=fmt, errors="coerce").notna().sum() for fmt in FORMATOS_DATA}
+    formato = max(FORMATOS_DATA, key=lambda fmt: acertos[fmt])
+    if formatos is not None and sheet_name is not None and acertos[formato]:
+        formatos[sheet_name] = formato
+    return formato
+
+def parse_date_series(serie, sheet_name=None, formatos=None):
+    """
+    Converte a coluna Data inteira para datetime64, uma única vez na carga.
+    
+    O formato é detectado em uma amostra e, se `formatos` for informado
+    (ver get_formatos_data), guardado nele por planilha; valores que não
+    seguem esse formato tentam os demais de FORMATOS_DATA, só na parte que
+    falhou. Vazios e datas inválidas viram NaT.
+    """
+    serie = pd.Series(serie)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    
+    texto = serie.where(serie.astype(str).str.strip() != "")
+    formato = _detectar_formato_data(texto, sheet_name, formatos)
+    datas = pd.to_datetime(texto, format=formato, errors="coerce")
+    
+    restantes = datas.isna() & texto.notna()
+    if formatos is not None and restantes.sum() * 2 > texto.notna().sum():
+        # A planilha mudou de formato: detectar de novo na próxima carga
+        formatos.pop(sheet_name, None)
+    for fmt in FORMATOS_DATA:
+        if not restantes.any():
+            break
+        if fmt == formato:
+            continue
+        datas[restantes] = pd.to_datetime(texto[restantes], format=fmt, errors="coerce")
+        restantes = datas.isna() & texto.notna()
+    return datas.astype("datetime64[ns]")
 
 ########################################## COMPATIBILIDADE ##########################################
 
+def componentes_mistura(quimicos):
+    """
+    Conjunto canônico dos componentes de uma calda: "A + B", "B + A" e
+    ["B", "A"] resultam no mesmo frozenset({"A", "B"}). O separador é o
+    mesmo de nome_mistura (" + "), então nomes com "+" ("NPK 10+10+10")
+    continuam sendo um único componente
+    """
+    if isinstance(quimicos, str):
+        quimicos = quimicos.split(" + ")
+    return frozenset(nome.strip() for nome in quimicos if isinstance(nome, str) and nome.strip())
+
+def nome_mistura(quimicos):
+    """Texto canônico da calda, com os componentes em ordem alfabética ("A + B")"""
+    return " + ".join(sorted(componentes_mistura(quimicos)))
+
+class CompatibilityIndex:
+    """
+    Índice dos testes de compatibilidade, montado uma vez por versão da
+    planilha Calculos (ver get_compatibility_index). Em registros fica o
+    DataFrame com o teste mais recente de cada combinação, em ordem de Data.
+    
+    Misturas de tanque são indexadas pelo conjunto de componentes (ver
+    componentes_mistura), então a ordem em que os químicos foram digitados
+    não importa. O índice guarda a lista ordenada de biológicos testados,
+    as caldas testadas com cada biológico e o registro mais recente de cada
+    par (Biologico, componentes); todas as consultas são acessos a
+    dicionário, independente do tamanho do histórico.
+    """
+    
+    def __init__(self, calculos):
+        self.biologicos = []
+        self.quimicos_por_biologico = {}
+        self.registros = pd.DataFrame(columns=list(calculos.columns) + ["Componentes"])
+        self._ultimos = {}
+        if calculos.empty or not {"Biologico", "Quimico"}.issubset(calculos.columns):
+            return
+        
+        # Componentes calculados uma vez por texto distinto da coluna Quimico
+        codigos, textos = pd.factorize(calculos["Quimico"])
+        componentes = np.array([componentes_mistura(t) if isinstance(t, str) else frozenset() for t in textos] + [frozenset()], dtype=object)
+        validos = calculos.assign(Componentes=componentes[codigos])
+        validos = validos[
+            validos["Biologico"].map(lambda v: isinstance(v, str) and v != "")
+            & validos["Componentes"].map(bool)
+        ]
+        # Ordem estável por Data: entre testes da mesma data vale o último gravado
+        if "Data" in validos.columns:
+            validos = validos.sort_values("Data", kind="stable", na_position="first")
+        ultimos = validos.drop_duplicates(subset=["Biologico", "Componentes"], keep="last")
+        self.registros = ultimos
+        
+        chaves = list(zip(ultimos["Biologico"], ultimos["Componentes"]))
+        self._ultimos = dict(zip(chaves, ultimos.drop(columns="Componentes").to_dict("records")))
+        for bio, mistura in sorted(chaves, key=lambda chave: chave[0]):
+            self.quimicos_por_biologico.setdefault(bio, []).append(nome_mistura(mistura))
+        for nomes in self.quimicos_por_biologico.values():
+            nomes.sort()
+        self.biologicos = list(self.quimicos_por_biologico)
+    
+    def quimicos(self, biologico):
+        """Caldas já testadas com o biológico (texto canônico), em ordem alfabética"""
+        return self.quimicos_por_biologico.get(biologico, [])
+    
+    def ultimo_resultado(self, biologico, quimicos):
+        """
+        Registro mais recente do biológico com exatamente esta calda, como
+        dicionário, ou None se a combinação nunca foi testada
+        """
+        return self._ultimos.get((biologico, componentes_mistura(quimicos)))
+
+
+def get_compatibility_index(calculos):
+    """Índice de compatibilidade da versão atual de Calculos (compartilhado entre sessões)"""
+    return memo_por_versao(versao_dados(calculos), "Calculos", "indice", (), lambda: CompatibilityIndex(calculos))
+
 def compatibilidade():
     # Inicializar variável de estado para controle do formulário
     if 'solicitar_novo_teste' not in st.session_state:
@@ -568,47 +2659,20 @@ def compatibilidade():
     # Interface de consulta de compatibilidade
     col1, col2 = st.columns([1, 1])
 
-    # Obter dados da planilha de cálculos
-    biologicos_unicos = []
-    quimicos_por_biologico = {}
-    
-    # Verificar se a planilha de cálculos tem dados
-    if "calculos" in dados and not dados["calculos"].empty:
-        # Verificar se a coluna "Biologico" existe
-        if "Biologico" in dados["calculos"].columns:
-            # Obter lista de biológicos únicos
-            biologicos_unicos = sorted(dados["calculos"]["Biologico"].unique())
-            
-            # Para cada biológico, obter os químicos testados
-            for bio in biologicos_unicos:
-                # Filtrar os resultados de cálculos para o biológico selecionado
-                resultados_bio = dados["calculos"][
-                    dados["calculos"]["Biologico"] == bio
-                ]
-                
-                # Extrair todos os químicos testados com este biológico
-                if not resultados_bio.empty and "Quimico" in resultados_bio.columns:
-                    quimicos_testados = []
-                    for quimico_entry in resultados_bio["Quimico"]:
-                        # Lidar com entradas que podem ter formato "quimico1 + quimico2"
-                        if isinstance(quimico_entry, str):
-                            quimicos_testados.append(quimico_entry)
-                    
-                    # Remover duplicatas e ordenar
-                    quimicos_por_biologico[bio] = sorted(set(quimicos_testados))
+    # Índice dos testes realizados (montado uma vez por versão da planilha de cálculos)
+    indice = get_compatibility_index(dados.get("calculos", pd.DataFrame()))
+    biologicos_unicos = indice.biologicos
 
     with col1:
         biologico = st.selectbox(
             "Produto Biológico",
-            options=biologicos_unicos if biologicos_unicos else sorted(dados["biologicos"]['Nome'].unique()),
+            options=biologicos_unicos if biologicos_unicos else opcoes_coluna(dados["biologicos"], "Biologicos", "Nome"),
             index=None,
             key="compatibilidade_biologico"
         )
 
     # Filtrar químicos com base no biológico selecionado
-    quimicos_disponiveis = []
-    if biologico and biologico in quimicos_por_biologico:
-        quimicos_disponiveis = quimicos_por_biologico[biologico]
+    quimicos_disponiveis = indice.quimicos(biologico) if biologico else []
     
     with col2:
         quimico = st.selectbox(
@@ -620,20 +2684,11 @@ def compatibilidade():
     
     if biologico and quimico:
         # Verificar se a planilha de cálculos tem dados
-        if "calculos" in dados and not dados["calculos"].empty and "Biologico" in dados["calculos"].columns and "Quimico" in dados["calculos"].columns:
-            # Procurar na planilha de Resultados usando os nomes
-            resultado_existente = dados["calculos"][
-                (dados["calculos"]["Biologico"] == biologico) & 
-                (dados["calculos"]["Quimico"] == quimico)
-            ]
+        if indice.biologicos:
+            # Resultado mais recente do par, direto do índice
+            resultado = indice.ultimo_resultado(biologico, quimico)
             
-            if not resultado_existente.empty:
-                # Ordenar por data (mais recente primeiro)
-                resultado_existente['Data'] = pd.to_datetime(resultado_existente['Data'], format='%d/%m/%Y', errors='coerce')
-                resultado_existente = resultado_existente.sort_values('Data', ascending=False)
-                
-                # Mostrar apenas o resultado mais recente
-                resultado = resultado_existente.iloc[0]
+            if resultado is not None:
                 compativel = "Compatível" in str(resultado["Resultado"])
                 
                 if compativel:
@@ -667,7 +2722,7 @@ def compatibilidade():
                         return f"{valor:.2f}"
                     
                     # Exibir campos na ordem especificada com unidades de medida
-                    st.write(f"**Data:** {resultado['Data'].strftime('%d/%m/%Y')}")
+                    st.write(f"**Data:** {resultado['Data'].strftime('%d/%m/%Y') if pd.notna(resultado['Data']) else '-'}")
                     st.write(f"**Biologico:** {resultado['Biologico']}")
                     st.write(f"**Quimico:** {resultado['Quimico']}")
                     st.write(f"**Tempo:** {resultado['Tempo']} horas")
@@ -762,9 +2817,8 @@ def mostrar_formulario_solicitacao(quimico=None, biologico=None):
             st.session_state.solicitar_novo_teste = False
             st.session_state.last_submission = nova_solicitacao
             
-            # Recarregar os dados diretamente do Google Sheets para evitar duplicações
-            load_all_data()
-            
+            # A linha já está no cache de Solicitacoes (ver append_to_sheet);
+            # as demais planilhas continuam em cache
             # Mostrar mensagem de sucesso imediatamente
             st.success("Solicitação de novo teste enviada com sucesso!")
             # Forçar recarregamento da página para atualizar os dados
@@ -805,14 +2859,328 @@ def mostrar_formulario_solicitacao(quimico=None, biologico=None):
             if st.form_submit_button("Cancelar"):
                 st.session_state.solicitar_novo_teste = False
 
+########################################## MATRIZ ##########################################
+
+# Código e cor de cada resultado no mapa de calor (combinações não testadas ficam em branco)
+CORES_RESULTADO = {
+    "Incompatível": (0, "#FFB6C1"),
+    "Compatível": (1, "#90EE90"),
+    "Compatível (Interação Positiva)": (2, "#2E8B57"),
+}
+
+def _montar_matriz(calculos, quimicos, eixo, incluir_misturas):
+    """
+    Pivota o teste mais recente de cada combinação em uma matriz
+    Biológico × Químico (ou × Classe do químico).
+    
+    Por classe, uma calda conta para a classe de cada um dos seus
+    componentes e vale o teste mais recente entre eles.
+    """
+    registros = get_compatibility_index(calculos).registros
+    if not incluir_misturas:
+        registros = registros[registros["Componentes"].map(len) == 1]
+    
+    if eixo == "Classe":
+        classes = {}
+        if not quimicos.empty and {"Nome", "Classe"}.issubset(quimicos.columns):
+            classes = dict(zip(quimicos["Nome"].astype(str), quimicos["Classe"].astype(str)))
+        registros = registros.assign(Componentes=registros["Componentes"].map(list)).explode("Componentes")
+        registros = registros.assign(Coluna=registros["Componentes"].map(lambda q: classes.get(q) or "Sem classe"))
+        # registros já está em ordem de Data: o último de cada célula é o mais recente
+        registros = registros.drop_duplicates(subset=["Biologico", "Coluna"], keep="last")
+    else:
+        registros = registros.assign(Coluna=registros["Componentes"].map(nome_mistura))
+    
+    if registros.empty:
+        return None
+    
+    # Texto do hover já formatado: serializar uma lista de strings é bem mais
+    # barato para o plotly do que um customdata com vários campos por célula
+    resultado = registros["Resultado"].astype(str)
+    razao = registros["Razao"].map(lambda r: "-" if pd.isna(r) else f"{r:.2f}")
+    data = registros["Data"].dt.strftime("%d/%m/%Y").fillna("-")
+    tabela = pd.DataFrame({
+        "Biologico": registros["Biologico"].to_numpy(),
+        "Coluna": registros["Coluna"].to_numpy(),
+        "Codigo": resultado.map(lambda r: CORES_RESULTADO.get(r, (np.nan,))[0]).to_numpy(dtype="float64"),
+        "Texto": (resultado + "<br>Razão: " + razao + "<br>Data: " + data).to_numpy(),
+    })
+    codigos = tabela.pivot(index="Biologico", columns="Coluna", values="Codigo")
+    textos = tabela.pivot(index="Biologico", columns="Coluna", values="Texto").fillna("")
+    return {
+        "linhas": list(codigos.index),
+        "colunas": list(codigos.columns),
+        "z": codigos.to_numpy(),
+        "textos": textos.to_numpy().tolist(),
+    }
+
+def get_matriz_compatibilidade(calculos, quimicos, eixo="Químico", incluir_misturas=False):
+    """Matriz de compatibilidade da versão atual dos dados (agregada uma vez e compartilhada entre sessões)"""
+    def calcular():
+        return _montar_matriz(calculos, quimicos, eixo, incluir_misturas)
+    versao_quimicos = versao_dados(quimicos)
+    if versao_quimicos is None:
+        return calcular()
+    return memo_por_versao(versao_dados(calculos), "Calculos", "matriz", (versao_quimicos, eixo, incluir_misturas), calcular)
+
+def _figura_matriz(matriz, filtro):
+    """Mapa de calor da matriz, restrito aos biológicos do filtro (se houver)"""
+    linhas = matriz["linhas"]
+    z = matriz["z"]
+    textos = matriz["textos"]
+    if filtro:
+        posicoes = [linhas.index(bio) for bio in filtro]
+        linhas = filtro
+        z = z[posicoes]
+        textos = [textos[i] for i in posicoes]
+    
+    # Escala discreta: cada código de resultado ocupa uma faixa da barra de cores
+    n = len(CORES_RESULTADO)
+    escala = []
+    for codigo, cor in sorted(CORES_RESULTADO.values()):
+        escala += [[codigo / n, cor], [(codigo + 1) / n, cor]]
+    
+    fig = go.Figure(go.Heatmap(
+        z=z,
+        x=matriz["colunas"],
+        y=linhas,
+        text=textos,
+        zmin=-0.5,
+        zmax=n - 0.5,
+        colorscale=escala,
+        xgap=1,
+        ygap=1,
+        hoverongaps=False,
+        hovertemplate="<b>%{y}</b> × <b>%{x}</b><br>%{text}<extra></extra>",
+        colorbar=dict(
+            tickvals=list(range(n)),
+            ticktext=[nome for nome, _ in sorted(CORES_RESULTADO.items(), key=lambda item: item[1][0])],
+        ),
+    ))
+    fig.update_layout(
+        height=min(max(400, 22 * len(linhas) + 150), 1600),
+        margin=dict(l=10, r=10, t=30, b=10),
+        xaxis=dict(side="top", tickangle=-45),
+        yaxis=dict(autorange="reversed"),
+        plot_bgcolor="#f0f0f0",
+    )
+    return fig
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _figura_cache(versoes, eixo, incluir_misturas, filtro, _matriz):
+    return _figura_matriz(_matriz, list(filtro))
+
+def matriz_compatibilidade():
+    st.title("🗺️ Matriz de Compatibilidade")
+    
+    dados = load_all_data()
+    if dados["calculos"].empty:
+        st.info("Nenhum teste de compatibilidade registrado ainda.")
+        return
+    
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        eixo = st.radio("Colunas", ["Químico", "Classe"], horizontal=True, key="matriz_eixo")
+    with col2:
+        incluir_misturas = st.checkbox("Incluir misturas de tanque", value=False, key="matriz_misturas")
+    
+    matriz = get_matriz_compatibilidade(dados["calculos"], dados["quimicos"], eixo, incluir_misturas)
+    if matriz is None:
+        st.info("Nenhum teste encontrado para os filtros selecionados.")
+        return
+    
+    with col3:
+        filtro = st.multiselect("Filtrar biológicos", options=matriz["linhas"], key="matriz_biologicos")
+    
+    # A validação do plotly ao montar a figura é a parte cara; ela também fica
+    # em cache por versão dos dados e filtro (o st.plotly_chart não a altera)
+    versoes = (versao_dados(dados["calculos"]), versao_dados(dados["quimicos"]))
+    if None in versoes:
+        fig = _figura_matriz(matriz, filtro)
+    else:
+        fig = _figura_cache(versoes, eixo, incluir_misturas, tuple(filtro), matriz)
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"{len(filtro or matriz['linhas'])} biológicos × {len(matriz['colunas'])} colunas. Células em cinza ainda não foram testadas.")
+
 ########################################## GERENCIAMENTO ##########################################
 
+# Paginação das tabelas do Gerenciamento: só a página visível vai para o navegador
+TAMANHOS_PAGINA = [25, 50, 100, 250]
+TAMANHO_PAGINA_PADRAO = 50
+
+def paginar_tabela(df, planilha, chave, ordenar_por, decrescente=False, filtros=None, preparar=None):
+    """
+    Controles de ordenação e paginação de uma tabela editável.
+    
+    Recebe a planilha inteira: o filtro, a ordenação e o fatiamento
+    acontecem no servidor e ficam memoizados pela versão dos dados (ver
+    memo_por_versao), então mexer em um widget não refaz esse trabalho.
+    A página volta pronta para o st.data_editor (índice de 0 a n-1,
+    categorias como texto e, se informado, transformada por `preparar`), e
+    os rótulos originais das linhas ficam em `ids`, para que mesclar_pagina
+    aplique as edições pela identidade das linhas. A chave do editor muda
+    junto com a página, a ordenação, os filtros e a versão dos dados, para
+    que edições de uma página nunca sejam reaplicadas em outra.
+    
+    Returns:
+        tuple: (página para o editor, ids das linhas, chave do editor)
+    """
+    colunas = COLUNAS_ESPERADAS[planilha]
+    filtros = tuple(sorted((coluna, valor) for coluna, valor in (filtros or {}).items() if valor != "Todos"))
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
+    with col1:
+        coluna = st.selectbox(
+            "Ordenar por", colunas,
+            index=colunas.index(ordenar_por) if ordenar_por in colunas else 0,
+            key=f"{chave}_ordem"
+        )
+    with col2:
+        sentido = st.selectbox(
+            "Sentido", ["Crescente", "Decrescente"],
+            index=1 if decrescente else 0,
+            key=f"{chave}_sentido"
+        )
+    with col3:
+        tamanho = st.selectbox(
+            "Linhas por página", TAMANHOS_PAGINA,
+            index=TAMANHOS_PAGINA.index(TAMANHO_PAGINA_PADRAO),
+            key=f"{chave}_tamanho"
+        )
+    crescente = sentido == "Crescente"
+    
+    def ordenar():
+        recorte = filtrar_tabela(df, planilha, filtros)
+        if recorte.empty:
+            return recorte
+        return recorte.sort_values(coluna, ascending=crescente, kind="stable", na_position="last")
+    versao = versao_dados(df)
+    ordenada = memo_por_versao(versao, planilha, "ordenada", (filtros, coluna, crescente), ordenar)
+    
+    total_paginas = max(1, -(-len(ordenada) // tamanho))
+    with col4:
+        pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1, key=f"{chave}_pagina")
+    pagina = min(int(pagina), total_paginas)
+    inicio = (pagina - 1) * tamanho
+    
+    def montar_pagina():
+        fatia = ordenada.iloc[inicio:inicio + tamanho]
+        visao = _para_edicao(fatia.reset_index(drop=True))
+        if preparar is not None:
+            visao = preparar(visao)
+        return visao, fatia.index
+    parametros = (filtros, coluna, crescente, inicio, tamanho, getattr(preparar, "__name__", None))
+    df_pagina, ids = memo_por_versao(versao, planilha, "pagina", parametros, montar_pagina)
+    
+    st.caption(f"Linhas {min(inicio + 1, len(ordenada))}–{inicio + len(ids)} de {len(ordenada)} (página {pagina} de {total_paginas})")
+    
+    assinatura = (pagina, tamanho, coluna, sentido, filtros, versao)
+    editor_key = f"{chave}_editor_{abs(hash(assinatura))}"
+    return df_pagina, ids, editor_key
+
+def mesclar_pagina(df_completo, ids, editado):
+    """
+    Aplica ao DataFrame completo as edições de uma página do editor.
+    
+    Linhas da página são identificadas pelos rótulos em `ids`: as editadas
+    substituem a original no mesmo lugar, as removidas saem e as incluídas
+    no editor (índice além da página) vão para o fim. O resto da tabela não
+    é tocado.
+    """
+    existentes = editado[editado.index < len(ids)]
+    novas = editado[editado.index >= len(ids)]
+    ids_existentes = ids[existentes.index]
+    
+    colunas = list(df_completo.columns)
+    atualizadas = existentes.reindex(columns=colunas).set_axis(ids_existentes)
+    mantidas = df_completo.drop(index=ids)
+    df_final = pd.concat([mantidas, atualizadas]).sort_index(kind="stable")
+    if not novas.empty:
+        df_final = pd.concat([df_final, novas.reindex(columns=colunas)], ignore_index=True)
+    return df_final.reset_index(drop=True)
+
+def mostrar_monitoramento():
+    """Exibe o limitador, as métricas das chamadas ao Google Sheets e o espelho local"""
+    st.subheader("Monitoramento do Google Sheets")
+    
+    if st.button("Atualizar", key="btn_atualizar_monitoramento"):
+        st.rerun()
+    
+    st.markdown("**Limitador de requisições**")
+    snapshot = get_rate_limiter().snapshot()
+    for tipo, stats in snapshot.items():
+        st.write(f"**{tipo.capitalize()}**")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Na fila agora", stats["na_fila"])
+        col2.metric("Tokens disponíveis", f"{stats['tokens_disponiveis']:.1f}")
+        col3.metric("Espera média (s)", f"{stats['espera_media']:.2f}")
+        col4.metric("Espera máxima (s)", f"{stats['espera_maxima']:.2f}")
+    
+    st.dataframe(
+        pd.DataFrame(snapshot).T[["requisicoes", "esperas", "recusadas", "espera_total"]],
+        use_container_width=True
+    )
+    
+    st.markdown("**Chamadas à API**")
+    metricas = get_metrics().snapshot()
+    st.caption(f"Desde {metricas['inicio']} · latências em segundos")
+    if metricas["chamadas"]:
+        chamadas = pd.DataFrame(metricas["chamadas"])
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Chamadas", int(chamadas["total"].sum()))
+        col2.metric("Erros de quota", int(chamadas["quota"].sum()))
+        col3.metric("Retentativas", int(chamadas["retentativas"].sum()))
+        col4.metric("Leituras coalescidas", int(chamadas["coalescidas"].sum()))
+        st.dataframe(chamadas, hide_index=True, use_container_width=True)
+    else:
+        st.info("Nenhuma chamada registrada ainda")
+    handles = metricas["handles"]
+    st.caption(f"Handles de planilha: {handles['acerto']} reaproveitados sem requisição · {handles['resolvido']} resolvidos na API")
+
+    st.markdown("**Cache compartilhado**")
+    if metricas["cache"]:
+        st.dataframe(
+            pd.DataFrame(metricas["cache"]),
+            hide_index=True,
+            use_container_width=True,
+            column_config={"taxa_acerto": st.column_config.ProgressColumn("Taxa de acerto", min_value=0, max_value=1, format="%.2f")}
+        )
+    atualizacao = get_background_refresher()
+    if atualizacao.intervalo <= 0:
+        st.caption("Atualização agendada desligada (EXPERIMENTOS_ATUALIZACAO_INTERVALO=0)")
+    else:
+        ultimo = atualizacao.ultimo_ciclo.strftime("%H:%M:%S") if atualizacao.ultimo_ciclo else "ainda não rodou"
+        st.caption(
+            f"Atualização agendada a cada {atualizacao.intervalo_atual:.0f} s "
+            f"(normal: {atualizacao.intervalo:.0f} s) · último ciclo: {ultimo}"
+        )
+
+    st.markdown("**Duração dos reruns**")
+    if metricas["reruns"]:
+        st.dataframe(pd.DataFrame(metricas["reruns"]), hide_index=True, use_container_width=True)
+
+    metricas["limitador"] = snapshot
+    st.download_button(
+        "Exportar snapshot (JSON)",
+        data=json.dumps(metricas, indent=2, ensure_ascii=False),
+        file_name=f"metricas_sheets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json",
+        key="btn_exportar_metricas"
+    )
+
+    st.markdown("**Espelho local (SQLite)**")
+    mirror = get_local_mirror()
+    if mirror is None:
+        st.warning("Espelho local indisponível")
+    else:
+        st.caption(mirror.path)
+        st.dataframe(mirror.status(), hide_index=True, use_container_width=True)
+
 def gerenciamento():
     st.title("⚙️ Gerenciamento")
 
-    # Inicialização dos dados locais
-    if 'local_data' not in st.session_state:
-        st.session_state.local_data = load_all_data()
+    # Obter os dados do cache compartilhado (só acessa o Google Sheets se expirado)
+    load_all_data()
     
     if 'edited_data' not in st.session_state:
         st.session_state.edited_data = {
@@ -827,7 +3195,7 @@ def gerenciamento():
     
     aba_selecionada = st.radio(
         "Selecione a aba:",
-        ["Biológicos", "Químicos", "Cálculos", "Solicitações"],
+        ["Biológicos", "Químicos", "Cálculos", "Solicitações", "Monitoramento"],
         key="management_tabs",
         horizontal=True,
         label_visibility="collapsed"
@@ -938,7 +3306,7 @@ def gerenciamento():
                 with col1:
                     filtro_nome = st.selectbox(
                         "🔍 Filtrar por Nome",
-                        options=["Todos"] + sorted(dados["biologicos"]['Nome'].unique().tolist()),
+                        options=["Todos"] + opcoes_coluna(dados["biologicos"], "Biologicos", "Nome"),
                         index=0,
                         key="filtro_nome_biologicos"
                     )
@@ -950,33 +3318,21 @@ def gerenciamento():
                         key="filtro_classe_biologicos"
                     )
 
-                # Aplicar filtro
-                df_filtrado = dados["biologicos"].copy()
-                if filtro_nome != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Nome"] == filtro_nome]
-                if filtro_classe != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Classe"] == filtro_classe]
-                
-                # Garantir colunas esperadas e tipos de dados
-                df_filtrado = df_filtrado[COLUNAS_ESPERADAS["Biologicos"]].copy()
-                
-                if df_filtrado.empty:
-                    df_filtrado = pd.DataFrame(columns=COLUNAS_ESPERADAS["Biologicos"])
-                else:
-                    # Garantir que todas as colunas numéricas são do tipo correto
-                    df_filtrado['Dose'] = pd.to_numeric(df_filtrado['Dose'], errors='coerce')
-                    df_filtrado['Concentracao'] = pd.to_numeric(df_filtrado['Concentracao'], errors='coerce')
-                
-                # Converter a coluna de concentração para notação científica
-                df_filtrado['Concentracao'] = df_filtrado['Concentracao'].apply(lambda x: f"{float(x):.2e}" if pd.notna(x) else '')
+                # Filtrar, ordenar e paginar no servidor: só a página vai para o editor,
+                # com a concentração em notação científica
+                df_pagina, ids_pagina, editor_key = paginar_tabela(
+                    dados["biologicos"], "Biologicos", "biologicos", "Nome",
+                    filtros={"Nome": filtro_nome, "Classe": filtro_classe},
+                    preparar=_concentracao_como_texto
+                )
                 
                 # Tabela editável
                 with st.form("biologicos_form", clear_on_submit=False):
                     edited_df = st.data_editor(
-                        df_filtrado,
+                        df_pagina,
                         hide_index=True,
                         num_rows="dynamic",
-                        key="biologicos_editor",
+                        key=editor_key,
                         column_config={
                             "Nome": st.column_config.TextColumn("Produto Biológico"),
                             "Classe": st.column_config.SelectboxColumn("Classe", options=["Bioestimulante", "Biofungicida", "Bionematicida", "Bioinseticida", "Inoculante"]),
@@ -985,8 +3341,8 @@ def gerenciamento():
                             "Dose": st.column_config.NumberColumn("Dose (kg/ha ou litro/ha)", min_value=0.0, step=0.01, format="%.3f"),
                             "Concentracao": st.column_config.TextColumn(
                                 "Concentração em bula (UFC/g ou UFC/ml)",
-                                help="Digite em notação científica (ex: 1e9)",
-                                validate="^[0-9]+\\.?[0-9]*[eE][-+]?[0-9]+$"
+                                help="Digite em notação científica (ex: 1e9, 1,5e9 ou 2×10^8)",
+                                validate="^\\s*[0-9]+([.,][0-9]*)?\\s*([eE][-+]?[0-9]+|[×xX]10\\^[-+]?[0-9]+)?\\s*$"
                             ),
                             "Fabricante": st.column_config.TextColumn("Fabricante")
                         },
@@ -997,27 +3353,18 @@ def gerenciamento():
                     )
 
                     # Converter e validar dados antes de salvar
-                    if not edited_df.equals(df_filtrado):
+                    if not edited_df.equals(df_pagina):
                         try:
                             edited_df_copy = edited_df.copy()
                             
-                            # Validar concentrações
-                            invalid_rows = []
-                            for idx, row in edited_df_copy.iterrows():
-                                if pd.notna(row['Concentracao']) and row['Concentracao'] != '':
-                                    try:
-                                        float(row['Concentracao'])
-                                    except ValueError:
-                                        invalid_rows.append(row['Nome'])
-                            
-                            if invalid_rows:
+                            # Validar e converter as concentrações em uma única passada
+                            concentracoes, invalidas = parse_scientific_series(edited_df_copy['Concentracao'])
+                            if invalidas.any():
+                                invalid_rows = edited_df_copy.loc[invalidas, 'Nome'].astype(str).tolist()
                                 st.error(f"Concentração inválida nos produtos: {', '.join(invalid_rows)}. Use notação científica (ex: 1e9)")
                                 return
                             
-                            # Converter concentrações válidas
-                            edited_df_copy['Concentracao'] = edited_df_copy['Concentracao'].apply(
-                                lambda x: convert_scientific_to_float(x) if pd.notna(x) and x != '' else None
-                            )
+                            edited_df_copy['Concentracao'] = concentracoes
                             
                             # Garantir tipo numérico para Dose
                             edited_df_copy['Dose'] = pd.to_numeric(edited_df_copy['Dose'], errors='coerce')
@@ -1033,18 +3380,8 @@ def gerenciamento():
                     if submitted:
                         with st.spinner("Salvando dados..."):
                             try:
-                                df_completo = st.session_state.local_data["biologicos"].copy()
-                                
-                                if filtro_nome != "Todos" or filtro_classe != "Todos":
-                                    mask = (
-                                        (df_completo["Nome"].isin(edited_df["Nome"])) &
-                                        (df_completo["Classe"] == filtro_classe if filtro_classe != "Todos" else True)
-                                    )
-                                else:
-                                    mask = pd.Series([True]*len(df_completo), index=df_completo.index)
-                                
-                                df_completo = df_completo[~mask]
-                                df_final = pd.concat([df_completo, edited_df], ignore_index=True)
+                                # Aplicar só as linhas da página, pela identidade de cada uma
+                                df_final = mesclar_pagina(st.session_state.local_data["biologicos"], ids_pagina, edited_df)
                                 df_final = df_final.drop_duplicates(subset=["Nome"], keep="last")
                                 df_final = df_final.sort_values(by="Nome").reset_index(drop=True)
                                 
@@ -1141,7 +3478,7 @@ def gerenciamento():
                 with col1:
                     filtro_nome = st.selectbox(
                         "🔍 Filtrar por Nome",
-                        options=["Todos"] + sorted(dados["quimicos"]['Nome'].unique().tolist()),
+                        options=["Todos"] + opcoes_coluna(dados["quimicos"], "Quimicos", "Nome"),
                         index=0,
                         key="filtro_nome_quimicos"
                     )
@@ -1153,26 +3490,19 @@ def gerenciamento():
                         key="filtro_classe_quimicos"
                     )
 
-                # Aplicar filtro
-                df_filtrado = dados["quimicos"].copy()
-                if filtro_nome != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Nome"] == filtro_nome]
-                if filtro_classe != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Classe"] == filtro_classe]
-                
-                # Garantir colunas esperadas
-                df_filtrado = df_filtrado[COLUNAS_ESPERADAS["Quimicos"]].copy()
-                
-                if df_filtrado.empty:
-                    df_filtrado = pd.DataFrame(columns=COLUNAS_ESPERADAS["Quimicos"])
+                # Filtrar, ordenar e paginar no servidor: só a página vai para o editor
+                df_pagina, ids_pagina, editor_key = paginar_tabela(
+                    dados["quimicos"], "Quimicos", "quimicos", "Nome",
+                    filtros={"Nome": filtro_nome, "Classe": filtro_classe}
+                )
                 
                 # Tabela editável
                 with st.form("quimicos_form"):
                     edited_df = st.data_editor(
-                        df_filtrado,
+                        df_pagina,
                         num_rows="dynamic",
                         hide_index=True,
-                        key="quimicos_editor",
+                        key=editor_key,
                         column_config={
                             "Nome": st.column_config.TextColumn("Nome do Produto"),
                             "Classe": st.column_config.SelectboxColumn("Classe", options=["Herbicida", "Fungicida", "Inseticida", "Adjuvante", "Nutricional"]),
@@ -1189,18 +3519,8 @@ def gerenciamento():
                     if st.form_submit_button("Salvar Alterações", use_container_width=True):
                         with st.spinner("Salvando dados..."):
                             try:
-                                df_completo = st.session_state.local_data["quimicos"].copy()
-                                
-                                if filtro_nome != "Todos" or filtro_classe != "Todos":
-                                    mask = (
-                                        (df_completo["Nome"].isin(edited_df["Nome"])) &
-                                        (df_completo["Classe"] == filtro_classe if filtro_classe != "Todos" else True)
-                                    )
-                                else:
-                                    mask = pd.Series([True]*len(df_completo), index=df_completo.index)
-                                
-                                df_completo = df_completo[~mask]
-                                df_final = pd.concat([df_completo, edited_df], ignore_index=True)
+                                # Aplicar só as linhas da página, pela identidade de cada uma
+                                df_final = mesclar_pagina(st.session_state.local_data["quimicos"], ids_pagina, edited_df)
                                 df_final = df_final.drop_duplicates(subset=["Nome"], keep="last")
                                 df_final = df_final.sort_values(by="Nome").reset_index(drop=True)
                                 
@@ -1323,71 +3643,33 @@ def gerenciamento():
                 with col2:
                     filtro_biologico = st.selectbox(
                         "🔍 Filtrar por Produto Biológico",
-                        options=["Todos"] + sorted(dados["solicitacoes"]["Biologico"].unique().tolist()),
+                        options=["Todos"] + opcoes_coluna(dados["solicitacoes"], "Solicitacoes", "Biologico"),
                         index=0,
                         key="filtro_biologico_solicitacoes"
                     )
                 with col3:
                     filtro_quimico = st.selectbox(
                         "🔍 Filtrar por Produto Químico",
-                        options=["Todos"] + sorted(dados["solicitacoes"]["Quimico"].unique().tolist()),
+                        options=["Todos"] + opcoes_coluna(dados["solicitacoes"], "Solicitacoes", "Quimico"),
                         index=0,
                         key="filtro_quimico_solicitacoes"
                     )
                 
-                # Aplicar filtros
-                if not dados["solicitacoes"].empty:
-                    df_filtrado = dados["solicitacoes"].copy()
-                else:
-                    df_filtrado = pd.DataFrame()
-
-                if filtro_status != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Status"] == filtro_status]
-                if filtro_biologico != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Biologico"] == filtro_biologico]
-                if filtro_quimico != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Quimico"] == filtro_quimico]
-                
-                # Garantir colunas esperadas
-                df_filtrado = df_filtrado[COLUNAS_ESPERADAS["Solicitacoes"]].copy()
-                
-                if df_filtrado.empty:
-                    df_filtrado = pd.DataFrame(columns=COLUNAS_ESPERADAS["Solicitacoes"])
-                else:
-                    # Garantir que todas as colunas existam no DataFrame
-                    for coluna in COLUNAS_ESPERADAS["Solicitacoes"]:
-                        if coluna not in df_filtrado.columns:
-                            df_filtrado[coluna] = ""
-                
-                # Garantir que a coluna Data seja do tipo correto
-                if 'Data' in df_filtrado.columns:
-                    # Converter a coluna de data para datetime
-                    try:
-                        df_filtrado["Data"] = pd.to_datetime(df_filtrado["Data"], format="%d/%m/%Y", errors='coerce')
-                    except Exception as e:
-                        st.warning(f"Alguns valores de data podem não estar no formato correto: {str(e)}")
-                
-                # Tabela editável com ordenação por Data
-                if not df_filtrado.empty:
-                    df_filtrado = df_filtrado.sort_values(by="Data", ascending=False).reset_index(drop=True)
+                # Filtrar, ordenar (por padrão, mais recentes primeiro) e paginar no servidor
+                df_pagina, ids_pagina, editor_key = paginar_tabela(
+                    dados["solicitacoes"], "Solicitacoes", "solicitacoes", "Data", decrescente=True,
+                    filtros={"Status": filtro_status, "Biologico": filtro_biologico, "Quimico": filtro_quimico}
+                )
                 
                 with st.form("solicitacoes_form"):
-                    # Garantir que todas as colunas estejam presentes antes de exibir
-                    for col in COLUNAS_ESPERADAS["Solicitacoes"]:
-                        if col not in df_filtrado.columns:
-                            df_filtrado[col] = ""
-                    
-                    # Garantir que o DataFrame tenha apenas as colunas esperadas e na ordem correta
-                    df_filtrado = df_filtrado[COLUNAS_ESPERADAS["Solicitacoes"]]
-                    
                     # Definir ordem explícita das colunas para exibição
                     column_order = ["Data", "Solicitante", "Biologico", "DoseBiologico", "Quimico", "DoseQuimico", "VolumeCalda", "Aplicacao", "Observacoes", "Status"]
                     
                     edited_df = st.data_editor(
-                        df_filtrado,
+                        df_pagina,
                         hide_index=True,
                         num_rows="dynamic",
-                        key="solicitacoes_editor",
+                        key=editor_key,
                         column_config={
                             "Data": st.column_config.DateColumn("Data da Solicitação", format="DD/MM/YYYY"),
                             "Solicitante": st.column_config.TextColumn("Solicitante"),
@@ -1418,24 +3700,8 @@ def gerenciamento():
                                 # Garantir que o DataFrame editado tenha as colunas na ordem correta
                                 edited_df = edited_df[COLUNAS_ESPERADAS["Solicitacoes"]]
                                 
-                                # Recarregar os dados mais recentes do Google Sheets
-                                load_all_data()
-                                df_completo = st.session_state.local_data["solicitacoes"].copy()
-                                
-                                # Remover os registros que foram editados para evitar duplicações
-                                if filtro_status != "Todos" or filtro_quimico != "Todos" or filtro_biologico != "Todos":
-                                    mask = (
-                                        (df_completo["Status"] == filtro_status if filtro_status != "Todos" else True) &
-                                        (df_completo["Quimico"] == filtro_quimico if filtro_quimico != "Todos" else True) &
-                                        (df_completo["Biologico"] == filtro_biologico if filtro_biologico != "Todos" else True)
-                                    )
-                                    df_completo = df_completo[~mask]
-                                else:
-                                    # Se não há filtros, substituir completamente os dados
-                                    df_completo = pd.DataFrame(columns=COLUNAS_ESPERADAS["Solicitacoes"])
-                                
-                                # Combinar os dados originais com os editados
-                                df_final = pd.concat([df_completo, edited_df], ignore_index=True)
+                                # Aplicar só as linhas da página, pela identidade de cada uma
+                                df_final = mesclar_pagina(dados["solicitacoes"], ids_pagina, edited_df)
                                 df_final = df_final.drop_duplicates(subset=["Data", "Solicitante", "Biologico", "Quimico"], keep="last")
                                 df_final = df_final.sort_values(by="Data").reset_index(drop=True)
                                 
@@ -1471,7 +3737,7 @@ def gerenciamento():
                 with col1:
                     filtro_biologico = st.selectbox(
                         "🔍 Filtrar por Biológico",
-                        options=["Todos"] + sorted(dados["calculos"]['Biologico'].unique().tolist()),
+                        options=["Todos"] + opcoes_coluna(dados["calculos"], "Calculos", "Biologico"),
                         index=0,
                         key="filtro_biologico_calculos"
                     )
@@ -1483,48 +3749,24 @@ def gerenciamento():
                         key="filtro_resultado_calculos"
                     )
 
-                # Aplicar filtro
-                df_filtrado = dados["calculos"].copy()
-                if filtro_biologico != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Biologico"] == filtro_biologico]
-                if filtro_resultado != "Todos":
-                    df_filtrado = df_filtrado[df_filtrado["Resultado"] == filtro_resultado]
-                
-                # Garantir colunas esperadas
+                # Colunas exibidas
                 colunas_calculos = ["Data", "Biologico", "Quimico", "Tempo", "Placa1", "Placa2", "Placa3", 
                                    "MédiaPlacas", "Diluicao", "ConcObtida", "Dose", "ConcAtivo", 
                                    "VolumeCalda", "ConcEsperada", "Razao", "Resultado", "Observacao"]
                 
-                # Garantir que todas as colunas existam no DataFrame
-                for coluna in colunas_calculos:
-                    if coluna not in df_filtrado.columns:
-                        df_filtrado[coluna] = ""
-                
-                df_filtrado = df_filtrado[colunas_calculos].copy()
-                
-                if df_filtrado.empty:
-                    df_filtrado = pd.DataFrame(columns=colunas_calculos)
-                else:
-                    # Garantir que todas as colunas numéricas são do tipo correto
-                    for col in ["Placa1", "Placa2", "Placa3", "MédiaPlacas", "Diluicao", 
-                               "ConcObtida", "Dose", "ConcAtivo", "VolumeCalda", "ConcEsperada", "Razao"]:
-                        if col in df_filtrado.columns:
-                            df_filtrado[col] = pd.to_numeric(df_filtrado[col], errors='coerce')
-                
-                # Converter a coluna de data para datetime
-                if "Data" in df_filtrado.columns and not df_filtrado["Data"].empty:
-                    try:
-                        df_filtrado["Data"] = pd.to_datetime(df_filtrado["Data"], format="%d/%m/%Y", errors='coerce')
-                    except Exception as e:
-                        st.warning(f"Alguns valores de data podem não estar no formato correto: {str(e)}")
+                # Filtrar, ordenar (por padrão, mais recentes primeiro) e paginar no servidor
+                df_pagina, ids_pagina, editor_key = paginar_tabela(
+                    dados["calculos"], "Calculos", "calculos", "Data", decrescente=True,
+                    filtros={"Biologico": filtro_biologico, "Resultado": filtro_resultado}
+                )
                 
                 # Tabela editável
                 with st.form("calculos_form", clear_on_submit=False):
                     edited_df = st.data_editor(
-                        df_filtrado,
+                        df_pagina,
                         hide_index=True,
                         num_rows="dynamic",
-                        key="calculos_editor",
+                        key=editor_key,
                         column_config={
                             "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
                             "Biologico": st.column_config.TextColumn("Produto Biológico"),
@@ -1559,22 +3801,8 @@ def gerenciamento():
                     if submitted:
                         with st.spinner("Salvando dados..."):
                             try:
-                                df_completo = st.session_state.local_data["calculos"].copy()
-                                
-                                # Identificar registros a serem atualizados com base nos filtros
-                                if filtro_biologico != "Todos" or filtro_resultado != "Todos":
-                                    mask = (
-                                        (df_completo["Biologico"] == filtro_biologico if filtro_biologico != "Todos" else True) &
-                                        (df_completo["Resultado"] == filtro_resultado if filtro_resultado != "Todos" else True)
-                                    )
-                                else:
-                                    mask = pd.Series([True]*len(df_completo), index=df_completo.index)
-                                
-                                # Remover registros que serão substituídos
-                                df_completo = df_completo[~mask]
-                                
-                                # Concatenar com os novos registros editados
-                                df_final = pd.concat([df_completo, edited_df], ignore_index=True)
+                                # Aplicar só as linhas da página, pela identidade de cada uma
+                                df_final = mesclar_pagina(st.session_state.local_data["calculos"], ids_pagina, edited_df)
                                 
                                 # Atualizar a planilha
                                 sucesso = update_sheet(df_final, "Calculos")
@@ -1587,6 +3815,10 @@ def gerenciamento():
                                     st.error("Erro ao registrar o resultado. Tente novamente.")
                             except Exception as e:
                                 st.error(f"Erro ao processar dados: {str(e)}")
+
+    # Conteúdo da tab Monitoramento
+    elif aba_selecionada == "Monitoramento":
+        mostrar_monitoramento()
     else:
         st.info("Preencha os valores acima para ver o resultado da compatibilidade.")
 
@@ -1613,14 +3845,17 @@ def calculos():
     with col1:
         biologico_selecionado = st.selectbox(
             "Selecione o Produto Biológico",
-            options=sorted(dados["biologicos"]["Nome"].unique()),
+            options=opcoes_coluna(dados["biologicos"], "Biologicos", "Nome"),
             key="calc_biologico"
         )
 
-        # Obter a dose registrada do biológico
-        dose_registrada = dados["biologicos"][
-            dados["biologicos"]["Nome"] == biologico_selecionado
-        ]["Dose"].iloc[0]
+        # Obter a dose registrada do biológico (tabela Nome → Dose memoizada por versão)
+        biologicos = dados["biologicos"]
+        doses = memo_por_versao(
+            versao_dados(biologicos), "Biologicos", "doses", (),
+            lambda: dict(zip(biologicos["Nome"].astype(str).to_numpy()[::-1], biologicos["Dose"].to_numpy()[::-1]))
+        )
+        dose_registrada = doses[biologico_selecionado]
         
         st.info(f"Dose registrada: {dose_registrada} L/ha ou kg/ha")
     
@@ -1628,7 +3863,7 @@ def calculos():
         # Limitar a seleção a no máximo 3 produtos químicos
         quimicos_selecionados = st.multiselect(
             "Selecione os Produtos Químicos (máximo 3)",
-            options=sorted(dados["quimicos"]["Nome"].unique()),
+            options=opcoes_coluna(dados["quimicos"], "Quimicos", "Nome"),
             key="calc_quimicos",
             max_selections=3
         )
@@ -1641,18 +3876,11 @@ def calculos():
         st.warning("Selecione no máximo 3 produtos químicos")
         return
     
-    # Verificar se já existe um cálculo com o mesmo biológico e químicos
+    # Verificar se já existe um cálculo com o mesmo biológico e químicos (em qualquer ordem)
     calculos_existentes = dados["calculos"]
     if not calculos_existentes.empty:
-        # Formatar os químicos selecionados como uma string para comparação
-        quimicos_texto = " + ".join(quimicos_selecionados)
-        
-        # Filtrar por biológico e químico
-        filtro_biologico = calculos_existentes["Biologico"] == biologico_selecionado
-        filtro_quimico = calculos_existentes["Quimico"] == quimicos_texto
-        registros_duplicados = calculos_existentes[filtro_biologico & filtro_quimico]
-        
-        if not registros_duplicados.empty:
+        indice = get_compatibility_index(calculos_existentes)
+        if indice.ultimo_resultado(biologico_selecionado, quimicos_selecionados) is not None:
             st.error(f"Já existe um registro de cálculo para {biologico_selecionado} com os mesmos produtos químicos. Selecione outros produtos para continuar.")
             return
     
@@ -1771,8 +3999,8 @@ def calculos():
             # Formatar a data no formato DD/MM/YYYY
             data_formatada = data_teste.strftime("%d/%m/%Y")
             
-            # Formatar os químicos selecionados como uma string
-            quimicos_texto = " + ".join(quimicos_selecionados)
+            # Formatar os químicos selecionados como uma string (ordem canônica)
+            quimicos_texto = nome_mistura(quimicos_selecionados)
             
             # Registrar na planilha de cálculos
             novo_registro = {
@@ -1800,8 +4028,6 @@ def calculos():
             
             if sucesso:
                 st.success("Resultado registrado com sucesso na planilha de cálculos!")
-                # Recarregar dados para atualizar a interface
-                load_all_data()
             else:
                 st.error("Erro ao registrar o resultado. Tente novamente.")
     else:
@@ -1867,12 +4093,13 @@ def main():
     st.sidebar.title("Menu")
     
     # Determinar o índice inicial com base na página atual
-    current_index = 0 if st.session_state.current_page == "Compatibilidade" else 1
+    paginas = ("Compatibilidade", "Matriz", "Gerenciamento")
+    current_index = paginas.index(st.session_state.current_page) if st.session_state.current_page in paginas else 0
     
     # Usar uma chave única para o radio button para evitar problemas de estado
     menu_option = st.sidebar.radio(
         "Selecione a funcionalidade:",
-        ("Compatibilidade", "Gerenciamento"),
+        paginas,
         index=current_index,
         key="menu_option_sidebar"
     )
@@ -1885,6 +4112,9 @@ def main():
 
     st.sidebar.markdown("---")
     
+    # Estado das gravações em segundo plano desta sessão
+    mostrar_status_gravacoes()
+    
     # Adicionar botão de logout se estiver autenticado
     if st.session_state.get('authenticated', False):
         if st.sidebar.button("Sair", key="logout_button"):
@@ -1894,6 +4124,8 @@ def main():
 
     if menu_option == "Compatibilidade":
         compatibilidade()
+    elif menu_option == "Matriz":
+        matriz_compatibilidade()
     elif menu_option == "Gerenciamento":
         if not st.session_state.get('authenticated', False):
             check_login()
@@ -1901,7 +4133,14 @@ def main():
             gerenciamento()
 
 if __name__ == "__main__":
+    inicio_rerun = time.perf_counter()
     try:
         main()
     except Exception as e:
-        st.error(f"Erro ao processar dados: {str(e)}")
\ No newline at end of file
+        st.error(f"Erro ao processar dados: {str(e)}")
+    finally:
+        # Duração do rerun (inclusive quando interrompido por st.rerun/st.stop)
+        get_metrics().registrar_rerun(
+            st.session_state.get("menu_option_sidebar", "-"),
+            time.perf_counter() - inicio_rerun
+        )
\ No newline at end of file
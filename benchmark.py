@@ -0,0 +1,282 @@
+"""
+Benchmark da camada de dados e das páginas do app.
+
+Executa os caminhos principais (load_all_data, a recarga sem mudanças nas
+planilhas, update_sheet, append_to_sheet, compatibilidade() e um rerun
+completo do Gerenciamento) contra o backend
+simulado em memória, com catálogos sintéticos e latência configurável.
+Para cada caminho registra o tempo de execução, as chamadas à API por
+operação e o pico de memória, e grava tudo em JSON para comparar versões.
+
+Uso:
+    python benchmark.py --linhas 100 1000 10000 --latencia 0.05 --saida resultados.json
+    python benchmark.py --comparar resultados_anteriores.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from random import Random
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app  # noqa: E402
+
+CAMINHOS = ["load_all_data_frio", "load_all_data_cache", "recarga_sem_mudancas", "update_sheet", "append_to_sheet", "compatibilidade", "gerenciamento"]
+
+def gerar_dados(linhas, seed=42):
+    """Gera planilhas sintéticas: Calculos e Solicitacoes com `linhas` linhas e catálogos proporcionais"""
+    rng = Random(seed)
+    n_catalogo = max(10, linhas // 10)
+    biologicos = [f"Biologico {i:05d}" for i in range(n_catalogo)]
+    quimicos = [f"Quimico {i:05d}" for i in range(n_catalogo)]
+    resultados = ["Compatível", "Compatível (Interação Positiva)", "Incompatível"]
+    inicio = datetime(2023, 1, 1)
+
+    def data():
+        return (inicio + timedelta(days=rng.randrange(700))).strftime("%d/%m/%Y")
+
+    return {
+        "Biologicos": pd.DataFrame([{
+            "Nome": nome,
+            "Classe": rng.choice(["Bioestimulante", "Biofungicida", "Bionematicida", "Bioinseticida", "Inoculante"]),
+            "IngredienteAtivo": f"Ativo {i}",
+            "Formulacao": rng.choice(["Suspensão concentrada", "Pó molhável"]),
+            "Dose": round(rng.uniform(0.1, 3), 2),
+            "Concentracao": f"{rng.uniform(1, 9):.2f}e{rng.randint(7, 10)}",
+            "Fabricante": f"Fabricante {i % 20}"
+        } for i, nome in enumerate(biologicos)]),
+        "Quimicos": pd.DataFrame([{
+            "Nome": nome,
+            "Classe": rng.choice(["Herbicida", "Fungicida", "Inseticida", "Adjuvante", "Nutricional"]),
+            "Fabricante": f"Fabricante {i % 20}",
+            "Dose": round(rng.uniform(0.1, 3), 2)
+        } for i, nome in enumerate(quimicos)]),
+        "Solicitacoes": pd.DataFrame([{
+            "Data": data(),
+            "Solicitante": f"Solicitante {i % 50}",
+            "Biologico": rng.choice(biologicos),
+            "DoseBiologico": 1.0,
+            "Quimico": rng.choice(quimicos),
+            "DoseQuimico": 1.0,
+            "VolumeCalda": 100,
+            "Aplicacao": "Pulverização",
+            "Observacoes": "",
+            "Status": rng.choice(["Pendente", "Em andamento", "Concluído", "Cancelado"])
+        } for i in range(linhas)]),
+        "Calculos": pd.DataFrame([{
+            "Data": data(),
+            "Biologico": rng.choice(biologicos),
+            "Quimico": " + ".join(rng.sample(quimicos, rng.randint(1, 3))),
+            "Tempo": rng.randint(1, 24),
+            "Placa1": rng.randint(0, 300),
+            "Placa2": rng.randint(0, 300),
+            "Placa3": rng.randint(0, 300),
+            "MédiaPlacas": 150.0,
+            "Diluicao": "1.00e+06",
+            "ConcObtida": "1.50e+09",
+            "Dose": 1.0,
+            "ConcAtivo": "1.00e+09",
+            "VolumeCalda": 100,
+            "ConcEsperada": "1.00e+07",
+            "Razao": round(rng.uniform(0.3, 2), 2),
+            "Resultado": rng.choice(resultados),
+            "Observacao": ""
+        } for i in range(linhas)])
+    }
+
+def preparar_ambiente(dados, latencia, latencia_conexao=0.0, pool=None):
+    """
+    Liga o módulo app a um backend simulado novo, com cache, fila e
+    executor próprios (sem limitador local nem espelho em disco)
+    """
+    client = app.MemorySpreadsheetClient(
+        dados=dados,
+        latencia=latencia,
+        latencia_conexao=latencia_conexao,
+        pool_conexoes=pool if pool is not None else app.HTTP_POOL_TAMANHO
+    )
+    registry = app.SheetHandleRegistry()
+    cache = app.SharedSheetCache()
+    fila = app.AppendQueue(client, registry, cache, flush_interval=3600)
+    refresher = app.SheetsRefresher(app.ThreadPoolExecutor(max_workers=4))
+    loader = app.SheetsLoader(client, registry, app.SheetsMetrics())
+
+    app.get_google_sheets_client = lambda: client
+    app.get_sheet_registry = lambda: registry
+    app.get_shared_cache = lambda: cache
+    app.get_append_queue = lambda: fila
+    app.get_refresher = lambda: refresher
+    app.get_loader = lambda: loader
+    app.get_local_mirror = lambda: None
+    return client, fila
+
+def _script_benchmark():
+    import streamlit as st
+    import app
+
+    acao = st.session_state.get("bench_acao")
+    if acao == "load_all_data":
+        app.load_all_data()
+    elif acao == "update_sheet":
+        df = app.load_all_data()["calculos"].copy()
+        df.loc[0, "Observacao"] = f"benchmark {st.session_state.bench_rodada}"
+        app.update_sheet(df, "Calculos")
+    elif acao == "append_to_sheet":
+        linha = {coluna: "" for coluna in app.COLUNAS_ESPERADAS["Calculos"]}
+        linha.update({"Data": "01/01/2024", "Biologico": "Biologico 00000", "Quimico": "Quimico 00000"})
+        app.load_all_data()
+        app.append_to_sheet(linha, "Calculos")
+        app.get_append_queue().flush("Calculos")
+    elif acao == "compatibilidade":
+        app.compatibilidade()
+    elif acao == "gerenciamento":
+        app.gerenciamento()
+
+def medir(client, func):
+    """Executa func medindo tempo, chamadas à API (por operação) e pico de memória"""
+    antes = dict(client.chamadas)
+    conexoes_antes = client.conexoes_abertas
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    func()
+    tempo = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    chamadas = {op: n - antes.get(op, 0) for op, n in client.chamadas.items() if n - antes.get(op, 0)}
+    return {
+        "tempo_s": round(tempo, 4),
+        "chamadas_api": chamadas,
+        "total_chamadas": sum(chamadas.values()),
+        "conexoes_abertas": client.conexoes_abertas - conexoes_antes,
+        "memoria_pico_mb": round(pico / 2**20, 2)
+    }
+
+def executar(linhas, latencia, caminhos, timeout, latencia_conexao=0.0, pool=None):
+    """Roda os caminhos escolhidos para um tamanho de planilha e retorna os resultados"""
+    dados = gerar_dados(linhas)
+    client, fila = preparar_ambiente(dados, latencia, latencia_conexao, pool)
+    at = AppTest.from_function(_script_benchmark, default_timeout=timeout)
+    resultados = []
+
+    def rodar(acao, rodada=0):
+        at.session_state["bench_acao"] = acao
+        at.session_state["bench_rodada"] = rodada
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"{acao}: {at.exception[0].value}")
+
+    def registrar(caminho, medida):
+        medida.update({"caminho": caminho, "linhas": linhas, "latencia_s": latencia})
+        resultados.append(medida)
+        print(f"{caminho:>22} | {linhas:>7} linhas | {medida['tempo_s']:>8.3f}s | "
+              f"{medida['total_chamadas']:>3} chamadas | {medida['conexoes_abertas']:>2} conexões | "
+              f"{medida['memoria_pico_mb']:>8.2f} MB")
+
+    # A carga a frio sempre roda, pois os demais caminhos dependem dela
+    registrar("load_all_data_frio", medir(client, lambda: rodar("load_all_data")))
+    if "load_all_data_cache" in caminhos:
+        registrar("load_all_data_cache", medir(client, lambda: rodar("load_all_data")))
+    if "recarga_sem_mudancas" in caminhos:
+        def recarregar():
+            app.get_loader().refresh(list(app.SHEET_GIDS), app.get_shared_cache(), fila)
+
+        registrar("recarga_sem_mudancas", medir(client, recarregar))
+    if "update_sheet" in caminhos:
+        registrar("update_sheet", medir(client, lambda: rodar("update_sheet", 1)))
+    if "append_to_sheet" in caminhos:
+        registrar("append_to_sheet", medir(client, lambda: rodar("append_to_sheet")))
+
+    if "compatibilidade" in caminhos:
+        rodar("compatibilidade")
+        biologico = dados["Calculos"]["Biologico"].iloc[0]
+        quimico = app.nome_mistura(dados["Calculos"]["Quimico"].iloc[0])
+
+        def selecionar_par():
+            at.selectbox(key="compatibilidade_biologico").select(biologico).run()
+            at.selectbox(key="compatibilidade_quimico").select(quimico).run()
+
+        registrar("compatibilidade", medir(client, selecionar_par))
+
+    if "gerenciamento" in caminhos:
+        at.session_state["bench_acao"] = "gerenciamento"
+        at.run()
+
+        def rerun_calculos():
+            at.radio(key="management_tabs").set_value("Cálculos").run()
+            at.radio(key="opcao_calculos").set_value("Testes realizados").run()
+
+        registrar("gerenciamento", medir(client, rerun_calculos))
+
+    return resultados
+
+def versao_atual():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecida"
+
+def comparar(resultados, arquivo_anterior):
+    """Mostra a variação de tempo e de chamadas em relação a uma execução anterior"""
+    with open(arquivo_anterior, encoding="utf-8") as f:
+        anterior = json.load(f)
+    base = {(r["caminho"], r["linhas"]): r for r in anterior["resultados"]}
+    print(f"\nComparação com {anterior.get('versao', '?')} ({arquivo_anterior}):")
+    for r in resultados:
+        b = base.get((r["caminho"], r["linhas"]))
+        if b is None:
+            continue
+        variacao = (r["tempo_s"] - b["tempo_s"]) / b["tempo_s"] * 100 if b["tempo_s"] else 0.0
+        print(f"{r['caminho']:>22} | {r['linhas']:>7} linhas | tempo {variacao:+7.1f}% | "
+              f"chamadas {b['total_chamadas']} -> {r['total_chamadas']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Tamanhos das planilhas de Calculos/Solicitacoes (ex: 100 1000 100000)")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência simulada por requisição (s)")
+    parser.add_argument("--latencia-conexao", type=float, default=0.0,
+                        help="Custo simulado de abrir uma conexão HTTP (handshake TLS), em segundos")
+    parser.add_argument("--pool", type=int, default=None,
+                        help="Conexões ociosas mantidas para reuso (padrão: HTTP_POOL_TAMANHO do app)")
+    parser.add_argument("--caminhos", nargs="+", choices=CAMINHOS, default=CAMINHOS)
+    parser.add_argument("--timeout", type=float, default=600, help="Tempo máximo por rerun do AppTest (s)")
+    parser.add_argument("--saida", default="benchmark_resultados.json", help="Arquivo JSON de saída")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args()
+
+    resultados = []
+    for linhas in args.linhas:
+        resultados.extend(executar(linhas, args.latencia, args.caminhos, args.timeout, args.latencia_conexao, args.pool))
+
+    saida = {
+        "versao": versao_atual(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {
+            "linhas": args.linhas,
+            "latencia_s": args.latencia,
+            "latencia_conexao_s": args.latencia_conexao,
+            "pool": args.pool if args.pool is not None else app.HTTP_POOL_TAMANHO,
+            "caminhos": args.caminhos
+        },
+        "resultados": resultados
+    }
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(saida, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados gravados em {args.saida}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+
+import pandas as pd
+import pytest
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+def _aguardar_estado(fila, estado, limite=5):
+    fim = time.monotonic() + limite
+    while time.monotonic() < fim:
+        if any(e["status"] == estado for e in fila.entries()):
+            return True
+        time.sleep(0.005)
+    return False
+
+def test_flush_simultaneo_nao_duplica_linhas():
+    # A latência mantém a gravação da thread em andamento durante o flush
+    client = app.MemorySpreadsheetClient(latencia=0.2)
+    fila = app.AppendQueue(client, app.SheetHandleRegistry(), app.SharedSheetCache(), flush_interval=0)
+    fila.enqueue("Quimicos", {"Nome": "A", "Classe": "Herbicida", "Fabricante": "X", "Dose": 1})
+    
+    assert _aguardar_estado(fila, "enviando")
+    assert fila.flush("Quimicos")
+    
+    assert fila.entries() == []
+    assert client._grids["Quimicos"][1:] == [["A", "Herbicida", "X", 1]]
+
+class _ClienteSemAppend(app.MemorySpreadsheetClient):
+    """Backend em memória em que só as inclusões de linhas falham"""
+    
+    def __init__(self, erro, **kwargs):
+        super().__init__(**kwargs)
+        self.erro = erro
+    
+    def request(self, method, endpoint, **kwargs):
+        if endpoint == "values.append":
+            raise self.erro
+        return super().request(method, endpoint, **kwargs)
+
+def _linha(nome):
+    return {"Nome": nome, "Classe": "Herbicida", "Fabricante": "X", "Dose": 1}
+
+def test_flush_com_quota_nao_confirma_linha_devolvida_a_fila():
+    client = _ClienteSemAppend(app.SimulatedQuotaError("Quota exceeded (simulado)"))
+    fila = app.AppendQueue(client, app.SheetHandleRegistry(), app.SharedSheetCache(), flush_interval=3600, quota_delay=3600)
+    fila.enqueue("Quimicos", _linha("A"))
+    
+    assert not fila.flush("Quimicos", timeout=1)
+    assert [e["status"] for e in fila.entries()] == ["pendente"]
+
+def _script_incluir_e_salvar():
+    import streamlit as st
+    import app
+    
+    st.session_state.setdefault("local_data", {})
+    app.append_to_sheet({"Nome": "A", "Classe": "Herbicida", "Fabricante": "X", "Dose": 1}, "Quimicos")
+    # Como nas abas de catálogo do Gerenciamento, a tabela é salva ordenada por Nome
+    df = app.get_shared_cache().peek("Quimicos").sort_values("Nome").reset_index(drop=True)
+    st.session_state["salvou"] = app.update_sheet(df, "Quimicos")
+
+@pytest.mark.parametrize("erro", [
+    app.SimulatedQuotaError("Quota exceeded (simulado)"),
+    ValueError("Falha de rede (simulada)")
+])
+def test_salvar_nao_grava_linhas_que_a_fila_nao_enviou(monkeypatch, erro):
+    dados = {"Quimicos": pd.DataFrame([_linha("B"), _linha("D")])}
+    client = _ClienteSemAppend(erro, dados=dados)
+    registry = app.SheetHandleRegistry()
+    cache = app.SharedSheetCache()
+    fila = app.AppendQueue(client, registry, cache, flush_interval=3600, quota_delay=3600)
+    app.SheetsLoader(client, registry, app.SheetsMetrics()).refresh(["Quimicos"], cache, fila)
+    for nome, valor in [("get_google_sheets_client", client), ("get_sheet_registry", registry),
+                        ("get_shared_cache", cache), ("get_append_queue", fila), ("get_local_mirror", None)]:
+        monkeypatch.setattr(app, nome, lambda valor=valor: valor)
+    
+    at = AppTest.from_function(_script_incluir_e_salvar, default_timeout=30)
+    at.run()
+    
+    assert not at.exception
+    assert at.session_state["salvou"] is False
+    assert [linha[0] for linha in client._grids["Quimicos"]] == ["Nome", "B", "D"]
+    assert len(fila.entries()) == 1
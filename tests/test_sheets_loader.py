@@ -0,0 +1,75 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+import benchmark  # noqa: E402
+
+PLANILHAS = list(app.SHEET_GIDS)
+
+def _ambiente():
+    client = app.MemorySpreadsheetClient(dados=benchmark.gerar_dados(50))
+    loader = app.SheetsLoader(client, app.SheetHandleRegistry(), app.SheetsMetrics())
+    cache = app.SharedSheetCache()
+    fila = app.AppendQueue(client, app.SheetHandleRegistry(), cache, flush_interval=3600)
+    return client, loader, cache, fila
+
+def _recarregar(client, loader, cache, fila):
+    """Executa uma recarga e retorna as chamadas à API e as planilhas com versão nova"""
+    antes = dict(client.chamadas)
+    versoes = {nome: cache.versao(cache.peek(nome)) for nome in PLANILHAS}
+    assert loader.refresh(PLANILHAS, cache, fila) == []
+    chamadas = {op: n - antes.get(op, 0) for op, n in client.chamadas.items() if n != antes.get(op, 0)}
+    novas = [nome for nome in PLANILHAS if cache.versao(cache.peek(nome)) != versoes[nome]]
+    return chamadas, novas
+
+def test_carga_a_frio_grava_revisao():
+    client, loader, cache, fila = _ambiente()
+    
+    chamadas, novas = _recarregar(client, loader, cache, fila)
+    
+    assert chamadas == {"drive.files.get": 1, "spreadsheets.get": 2, "values.batchGet": 1}
+    assert novas == PLANILHAS
+    revisao = client.open_by_key(app.SHEET_ID).get_lastUpdateTime()
+    assert all(cache.peek(nome).attrs["revisao"] == revisao for nome in PLANILHAS)
+
+def test_recarga_sem_mudancas_so_consulta_revisao():
+    ambiente = _ambiente()
+    _recarregar(*ambiente)
+    
+    chamadas, novas = _recarregar(*ambiente)
+    
+    assert chamadas == {"drive.files.get": 1}
+    assert novas == []
+
+def test_recarga_com_uma_planilha_alterada_le_uma_vez():
+    client, loader, cache, fila = _ambiente()
+    _recarregar(client, loader, cache, fila)
+    # Edição em uma coluna distante, sem mudar o número de linhas
+    client.open_by_key(app.SHEET_ID).worksheet("Calculos").update("Q2", [["editado"]])
+    
+    chamadas, novas = _recarregar(client, loader, cache, fila)
+    
+    assert chamadas == {"drive.files.get": 1, "values.batchGet": 1}
+    assert novas == ["Calculos"]
+    assert cache.peek("Calculos")["Observacao"].iloc[0] == "editado"
+
+def test_leitura_aproveitada_com_falha_nao_descarta_o_lote():
+    client, loader, cache, fila = _ambiente()
+    # Outra sessão está lendo Quimicos: a recarga espera por essa leitura
+    chave = ("Quimicos", app.INTERVALO_COMPLETO)
+    loader._voos.reservar([chave])
+    recarga = threading.Thread(target=loader.refresh, args=(PLANILHAS, cache, fila))
+    recarga.start()
+    fim = time.monotonic() + 5
+    while client.chamadas.get("values.batchGet", 0) < 1 and time.monotonic() < fim:
+        time.sleep(0.01)
+    loader._voos.concluir(chave, erro=RuntimeError("falha na leitura da outra sessão"))
+    recarga.join(5)
+    
+    # O lote próprio vai para o cache; só Quimicos é lida de novo, sozinha
+    assert all(cache.peek(nome) is not None for nome in PLANILHAS)
+    assert client.chamadas["values.batchGet"] == 1
+    assert client.chamadas["values.get"] == 1